@@ -0,0 +1,97 @@
+## Accounting for calls made to Synapse.
+##
+## Wrap a logged-in client with CountingSynapse and hand the wrapper to
+## everything that would have used the client. Calls to the methods in
+## COUNTED_METHODS are counted and timed by method and by the line of the
+## harness that made them. An optional budget and rate limit keep a run from
+## tripping Synapse's throttling, and summary() prints where the calls came
+## from so that N+1 patterns stand out.
+
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from outbox import TokenBucket
+
+COUNTED_METHODS = set([
+    'restGET', 'restPUT', 'restPOST', 'restDELETE',
+    'get', 'store', 'delete', 'getWiki', 'sendMessage', 'tableQuery',
+    'getEvaluation', 'getSubmission', 'getSubmissionStatus', 'getSubmissionBundles',
+    'getUserProfile', 'getTeam', 'getChildren', 'setPermissions',
+])
+
+# burst size for the rate limit, in calls
+API_RATE_BURST = 10
+
+# how many call sites summary() shows
+API_SUMMARY_TOP = 10
+
+
+class BudgetExceeded(Exception):
+    """Raised instead of making a call once a run has used up its budget"""
+    pass
+
+
+class CountingSynapse(object):
+    """
+    Passes everything through to a Synapse client, counting and timing the
+    calls listed in COUNTED_METHODS.
+
+    :param budget: the most calls to allow, or None for no limit
+    :param rate: the most calls per second to make, or None for no limit
+    """
+    def __init__(self, syn, budget=None, rate=None, burst=API_RATE_BURST):
+        self.__dict__['_syn'] = syn
+        self.__dict__['budget'] = budget
+        self.__dict__['bucket'] = TokenBucket(rate, burst) if rate else None
+        self.__dict__['lock'] = threading.Lock()
+        self.__dict__['calls'] = Counter()
+        self.__dict__['seconds'] = defaultdict(float)
+        self.__dict__['sites'] = Counter()
+
+    def __getattr__(self, name):
+        attr = getattr(self._syn, name)
+        if name not in COUNTED_METHODS or not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            caller = sys._getframe(1)
+            site = '%s:%d %s' % (os.path.basename(caller.f_code.co_filename), caller.f_lineno, caller.f_code.co_name)
+            with self.lock:
+                if self.budget is not None and sum(self.calls.itervalues()) >= self.budget:
+                    raise BudgetExceeded("Used up the budget of %d Synapse calls, stopping at %s from %s" % (self.budget, name, site))
+                self.calls[name] += 1
+                self.sites[(site, name)] += 1
+                ## holding the lock makes waiting callers queue up behind the bucket
+                if self.bucket is not None:
+                    self.bucket.take()
+            start = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.seconds[name] += time.time() - start
+        return counted
+
+    def __setattr__(self, name, value):
+        setattr(self._syn, name, value)
+
+    def total(self):
+        return sum(self.calls.itervalues())
+
+    def summary(self, out=sys.stdout, top=API_SUMMARY_TOP):
+        """Print calls and time per method, then the busiest call sites"""
+        if not self.calls:
+            return
+        out.write("\n%-24s %9s %10s\n" % ('Synapse call', 'count', 'total(s)'))
+        out.write("-" * 45 + "\n")
+        for name, count in self.calls.most_common():
+            out.write("%-24s %9d %10.2f\n" % (name, count, self.seconds[name]))
+        out.write("%-24s %9d\n" % ('all', self.total()))
+        out.write("\n%-60s %-20s %9s\n" % ('call site', 'method', 'count'))
+        out.write("-" * 91 + "\n")
+        for (site, name), count in self.sites.most_common(top):
+            out.write("%-60s %-20s %9d\n" % (site, name, count))
+
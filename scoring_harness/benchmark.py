@@ -0,0 +1,170 @@
+## Measure the scoring harness end to end against a FakeSynapse, without
+## touching the live service.
+##
+## Each stage runs over synthetic challenges of increasing size in a child
+## process of its own, so that peak memory is per run. The checker is
+## replaced by a stub that takes --checker-seconds, so timings reflect the
+## harness itself rather than the workflows being checked.
+##
+##   python benchmark.py --sizes 10 1000 --stages validate score --latency 0.01
+##
+## With --startup, it instead checks that challenge.py still starts quickly,
+## exiting with an error if importing it got slower than STARTUP_THRESHOLD
+## or started loading any of STARTUP_HEAVY_MODULES.
+
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import challenge_config as conf
+from fake_synapse import FakeSynapse
+
+STAGES = ['validate', 'validate_reports', 'score', 'summarize', 'archive']
+
+## what each stage needs the submissions to look like beforehand
+STAGE_FIXTURES = {
+    'validate': dict(status='RECEIVED'),
+    'validate_reports': dict(status='VALIDATED', report_status='EMPTY'),
+    'score': dict(status='VALIDATED'),
+    'summarize': dict(status='VALIDATED', report_status='VALIDATED'),
+    'archive': dict(status='SCORED'),
+}
+
+BENCHMARK_DEFAULT_SIZES = [10, 1000, 100000]
+
+# modules that quick commands like list shouldn't pay for loading
+STARTUP_HEAVY_MODULES = ['synapseclient', 'synapseutils', 'requests', 'pandas', 'yaml']
+
+# the most seconds importing challenge.py may take
+STARTUP_THRESHOLD = 0.25
+
+
+def _run_stage(stage, syn, checker_seconds):
+    import challenge as chal
+    import messages
+    from cache import TTLCache
+    from identity import IdentityResolver
+
+    chal.syn = syn
+    messages.syn = syn
+    cache_dir = tempfile.mkdtemp()
+    chal.identities = IdentityResolver(syn, cache=TTLCache(cache_dir))
+
+    def validate_submission(syn, evaluation, submission, annotations):
+        time.sleep(checker_seconds)
+        return True, "Validated!"
+    conf.validate_submission = validate_submission
+
+    try:
+        if stage == 'summarize':
+            import summarize_submissions as summ
+            submission_df = summ.collect_submissions(syn, conf.CHALLENGE_SYN_ID)
+            valid_df = summ.filter_submissions(submission_df)
+            summ.update_validated_submissions_table(syn, conf.CHALLENGE_SYN_ID, valid_df)
+            team_stats_df = summ.compute_team_stats(valid_df)
+            summ.update_team_stats_table(syn, conf.CHALLENGE_SYN_ID, team_stats_df)
+            overall_stats_df = summ.compute_overall_stats(valid_df, team_stats_df)
+            summ.update_overall_stats_table(syn, conf.CHALLENGE_SYN_ID, overall_stats_df)
+            return
+        for evaluation_id in syn.evaluations:
+            if stage == 'validate':
+                chal.validate(evaluation_id, canCancel=True)
+            elif stage == 'validate_reports':
+                chal.validate_reports(evaluation_id, canCancel=True)
+            elif stage == 'score':
+                chal.score(evaluation_id, canCancel=True)
+            elif stage == 'archive':
+                chal.archive(evaluation_id, 'submission', destination='syn100')
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def _child(stage, size, latency, checker_seconds, results):
+    syn = FakeSynapse([q['id'] for q in conf.evaluation_queues], size,
+                      latency=latency, project_id=conf.CHALLENGE_SYN_ID,
+                      **STAGE_FIXTURES[stage])
+    ## the harness is chatty; keep the report readable
+    devnull = open(os.devnull, 'w')
+    sys.stdout = devnull
+    error = None
+    start = time.time()
+    try:
+        _run_stage(stage, syn, checker_seconds)
+    except Exception as ex1:
+        error = '%s: %s' % (type(ex1).__name__, ex1)
+    seconds = time.time() - start
+    sys.stdout = sys.__stdout__
+    shutil.rmtree(syn.tempdir, ignore_errors=True)
+    results.put(dict(stage=stage, size=size, seconds=seconds,
+                     calls=dict(syn.calls), error=error,
+                     ## kilobytes on Linux
+                     max_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def run(stage, size, latency=0.0, checker_seconds=0.0):
+    """Run one stage over a synthetic challenge of the given size"""
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_child, args=(stage, size, latency, checker_seconds, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def startup(repeat=5):
+    """
+    Time importing challenge.py in a fresh interpreter, best of repeat.
+
+    :returns: (seconds, heavy modules loaded)
+    """
+    code = ("import sys, time; start = time.time(); import challenge; print time.time() - start; "
+            "print ' '.join(m for m in %r if m in sys.modules)" % STARTUP_HEAVY_MODULES)
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    best = None
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=script_dir).splitlines()
+        seconds, loaded = float(output[0]), output[1].split() if len(output) > 1 else []
+        best = seconds if best is None else min(best, seconds)
+    return best, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scoring harness against a fake Synapse")
+    parser.add_argument("--sizes", metavar="N", type=int, nargs='+', default=BENCHMARK_DEFAULT_SIZES,
+                        help="Numbers of submissions in the synthetic challenges")
+    parser.add_argument("--stages", choices=STAGES, nargs='+', default=STAGES)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each Synapse call takes")
+    parser.add_argument("--checker-seconds", type=float, default=0.0, help="Seconds each validation takes")
+    parser.add_argument("--startup", action="store_true", default=False, help="Check how quickly challenge.py starts instead")
+    args = parser.parse_args()
+
+    if args.startup:
+        seconds, loaded = startup()
+        print "importing challenge.py: %.3f s (threshold %.3f s)" % (seconds, STARTUP_THRESHOLD)
+        if loaded:
+            print "loaded at startup:", ", ".join(loaded)
+        return 1 if loaded or seconds > STARTUP_THRESHOLD else 0
+
+    print "%-18s %8s %10s %10s %12s  %s" % ('stage', 'size', 'wall(s)', 'API calls', 'peak RSS(MB)', 'top calls')
+    print "-" * 100
+    for stage in args.stages:
+        for size in args.sizes:
+            result = run(stage, size, args.latency, args.checker_seconds)
+            top = sorted(result['calls'].items(), key=lambda item: -item[1])[:4]
+            print "%-18s %8d %10.2f %10d %12.1f  %s" % (
+                stage, size, result['seconds'], sum(result['calls'].values()),
+                result['max_rss'] / 1024.0,
+                ', '.join('%s=%d' % item for item in top))
+            if result['error']:
+                print "    failed:", result['error']
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import errno
+import hashlib
+import json
+import os
+import time
+
+# default time to live of cached values, in seconds
+CACHE_DEFAULT_TTL = 30
+
+
+class TTLCache(object):
+    """
+    Caches JSON-serializable values on disk, one file per key under dir,
+    for ttl seconds.
+    """
+    def __init__(self, dir, ttl=CACHE_DEFAULT_TTL):
+        self.dir = dir
+        self.ttl = ttl
+
+    def _path(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.dir, hashlib.md5(key).hexdigest() + '.json')
+
+    def get(self, key, ttl=None):
+        """Return the cached value for key, or None if missing or expired"""
+        path = self._path(key)
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            if time.time() - os.path.getmtime(path) > ttl:
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, IOError, ValueError):
+            return None
+
+    def set(self, key, value):
+        try:
+            os.makedirs(self.dir)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        path = self._path(key)
+        ## write then rename so concurrent readers never see a partial file
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.rename(tmp_path, path)
+        return value
+
+    def get_many(self, keys, ttl=None):
+        """Return a dict of the keys found in the cache"""
+        found = {}
+        for key in keys:
+            value = self.get(key, ttl)
+            if value is not None:
+                found[key] = value
+        return found
@@ -16,34 +16,30 @@
 ###############################################################################
 
 
-import synapseclient
-import synapseclient.utils as utils
-from synapseclient.exceptions import *
-from synapseclient import Activity
-from synapseclient import Project, Folder, File
-from synapseclient import Evaluation, Submission, SubmissionStatus
-from synapseclient import Wiki
-from synapseclient import Column
-from synapseclient.dict_object import DictObject
-from synapseclient.annotations import from_submission_status_annotations
-import synapseutils as synu
+## synapseclient takes most of a second to import, so functions import what
+## they need from it when called. Commands answered from the local cache,
+## like a repeated list, then never load it.
 
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from datetime import datetime, timedelta
 from itertools import izip
 from StringIO import StringIO
-import copy
+from Queue import Queue
 
 import argparse
+import csv
 import lock
 import json
 import math
 import os
 import random
 import re
+import shutil
+import signal
+import subprocess
 import sys
-import tarfile
-import tempfile
+import threading
 import time
 import traceback
 import urllib
@@ -56,7 +52,21 @@ except Exception as ex1:
     sys.stderr.write("\nPlease configure your challenge. See challenge_config.template.py for an example.\n\n")
     raise ex1
 
+import apicalls
+import client
+import journal
 import messages
+import outbox
+import runtimes
+import scheduler
+import tracing
+import workqueue
+from cache import TTLCache
+from identity import IdentityResolver
+import identity
+
+## get_user_name moved to identity; kept here for scripts that import it from challenge
+get_user_name = identity.get_user_name
 
 
 # the batch size can be bigger, we do this just to demonstrate batching
@@ -65,89 +75,211 @@ BATCH_SIZE = 20
 # how many times to we retry batch uploads of submission annotations
 BATCH_UPLOAD_RETRY_COUNT = 5
 
+# how many leaderboard rows to accumulate before storing them in one
+# table transaction
+LEADERBOARD_BATCH_SIZE = 100
+
+# page size and number of concurrent page requests when exporting a
+# leaderboard from the submission query service
+EXPORT_PAGE_SIZE = 500
+EXPORT_THREADS = 4
+
+# the submission fields shown by the list command, and how long (in seconds)
+# list and status results are cached locally
+LIST_COLUMNS = ['objectId', 'createdOn', 'status', 'name', 'userId']
+LIST_CACHE_TTL = 30
+
+# how many submission files to download at once when archiving
+ARCHIVE_DOWNLOAD_THREADS = 4
+
+# how many downloaded files may wait in the staging area to be added to the
+# archive; together with the download threads, this bounds the disk used
+ARCHIVE_STAGING_SIZE = 8
+
+# external compressors that can consume a tar stream on stdin using multiple
+# cores; 'gz' uses tarfile's built-in, single threaded gzip
+ARCHIVE_COMPRESSORS = {
+    'pigz': (['pigz', '-c'], '.tgz'),
+    'zstd': (['zstd', '-T0', '-q', '-c'], '.tar.zst'),
+}
+
+# how many writeup projects to copy at once when archiving, and how many
+# times to try each copy before giving up on it
+ARCHIVE_COPY_THREADS = 4
+ARCHIVE_COPY_RETRY_COUNT = 3
+
+# how often the serve daemon polls a queue: right after finding work it
+# polls every SERVE_MIN_INTERVAL seconds, doubling up to SERVE_MAX_INTERVAL
+# while the queue stays idle
+SERVE_MIN_INTERVAL = 5
+SERVE_MAX_INTERVAL = 300
+
+# stages run at once by the serve daemon; the checker writes to a shared
+# output folder, so more than one validate at a time isn't safe
+SERVE_WORKERS = 1
+
+# how often the serve daemon prints and resets its stage timings, in seconds
+SERVE_SUMMARY_INTERVAL = 60*60
+
+# stages with no quick check for pending work poll no more often than this;
+# reports are edited by hand, so a few minutes' lag is fine
+SERVE_STAGE_MIN_INTERVAL = {'validate_reports': 5*60}
+
+# the status a submission is waiting in for each stage the daemon runs
+SERVE_STAGES = OrderedDict([
+    ('validate', 'RECEIVED'),
+    ('validate_reports', None),
+    ('score', 'VALIDATED'),
+])
+
+# the stages the daemon runs unless told otherwise, like the cron job;
+# scoring moves submissions on from VALIDATED before their reports are
+# checked, so it has to be asked for
+SERVE_DEFAULT_STAGES = ['validate', 'validate_reports']
+
+# how often an idle worker looks for a job to claim, in seconds
+WORKER_POLL_INTERVAL = 10
+
 UUID_REGEX = re.compile('[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
 
 # A module level variable to hold the Synapse connection
 syn = None
 
+# resolves user and team IDs to names; see get_identities()
+identities = None
+
+# orders the submissions waiting to be validated; None keeps Synapse's order
+submission_scheduler = None
+
+# (stage, submission ID) of messages held for digests, not yet sent
+_digested = []
+_digest_lock = threading.Lock()
+
+# where validate hands the checker off to workers on other hosts; None runs
+# it here
+work_queue = None
+
+# local cache of query results for the list and status commands
+query_cache = TTLCache(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cache'), ttl=LIST_CACHE_TTL)
+
+
+def _get_evaluation(evaluation):
+    """The Evaluation object for an evaluation or its ID"""
+    from synapseclient import Evaluation
+    if type(evaluation) != Evaluation:
+        evaluation = syn.getEvaluation(evaluation)
+    return evaluation
+
 
 def to_column_objects(leaderboard_columns):
     """
     Turns a list of dictionaries of column configuration information defined
     in conf.leaderboard_columns) into a list of Column objects
     """
+    from synapseclient import Column
     column_keys = ['name', 'columnType', 'maximumSize', 'enumValues', 'defaultValue']
     return [Column(**{ key: col[key] for key in column_keys if key in col}) for col in leaderboard_columns]
 
 
-def get_user_name(profile):
-    names = []
-    if 'firstName' in profile and profile['firstName'] and profile['firstName'].strip():
-        names.append(profile['firstName'])
-    if 'lastName' in profile and profile['lastName'] and profile['lastName'].strip():
-        names.append(profile['lastName'])
-    if len(names)==0:
-        names.append(profile['userName'])
-    return " ".join(names)
+def get_identities():
+    """
+    The shared IdentityResolver for user and team names, created on first use
+    """
+    global identities
+    if identities is None:
+        identities = IdentityResolver(syn)
+    return identities
 
-def update_single_submission_status(status, add_annotations, force=False):
+def _annotation_map(annotations, is_private=None):
     """
-    This will update a single submission's status
+    Flatten submission status annotations into a single dict of
+    key -> (value, isPrivate). If is_private is given, annotations is taken
+    to be a plain dict of key -> value with that visibility.
+    """
+    if is_private is not None:
+        return {key: (value, is_private) for key, value in annotations.iteritems()}
+    return {each['key']: (each['value'], each['isPrivate'])
+            for annotType in ['stringAnnos', 'longAnnos', 'doubleAnnos']
+            for each in annotations.get(annotType) or []}
+
+
+def merge_submission_status(status, add_annotations, force=False):
+    """
+    Merge annotations into a submission status in a single pass.
+
     :param:    Submission status: syn.getSubmissionStatus()
 
     :param:    Annotations that you want to add in dict or submission status annotations format.
                If dict, all submissions will be added as private submissions
-    """
-    existingAnnotations = status.get("annotations", dict())
-    privateAnnotations = {each['key']:each['value'] for annots in existingAnnotations for each in existingAnnotations[annots] if annots not in ['scopeId','objectId'] and each['isPrivate'] == True}
-    publicAnnotations = {each['key']:each['value'] for annots in existingAnnotations for each in existingAnnotations[annots] if annots not in ['scopeId','objectId'] and each['isPrivate'] == False}
 
+    :returns:  (status, changes) where changes maps each key whose value or
+               visibility changed to its new (value, isPrivate). If there are
+               no changes, the status is returned untouched.
+    """
+    import synapseclient
+    existing = _annotation_map(status.get("annotations", dict()))
     if not synapseclient.annotations.is_submission_status_annotations(add_annotations):
-        privateAddedAnnotations = add_annotations
-        publicAddedAnnotations = dict()
-    else:
-        privateAddedAnnotations = {each['key']:each['value'] for annots in add_annotations for each in add_annotations[annots] if annots not in ['scopeId','objectId'] and each['isPrivate'] == True}
-        publicAddedAnnotations = {each['key']:each['value'] for annots in add_annotations for each in add_annotations[annots] if annots not in ['scopeId','objectId'] and each['isPrivate'] == False} 
-    #If you add a private annotation that appears in the public annotation, it switches 
-    if sum([key in publicAddedAnnotations for key in privateAnnotations]) == 0:
-        pass
-    elif sum([key in publicAddedAnnotations for key in privateAnnotations]) >0 and force:
-        privateAnnotations = {key:privateAnnotations[key] for key in privateAnnotations if key not in publicAddedAnnotations}
-    else:
-        raise ValueError("You are trying to add public annotations that are already part of the existing private annotations: %s.  Either change the annotation key or specify force=True" % ", ".join([key for key in privateAnnotations if key in publicAddedAnnotations]))
-    if sum([key in privateAddedAnnotations for key in publicAnnotations]) == 0:
-        pass
-    elif sum([key in privateAddedAnnotations for key in publicAnnotations])>0 and force:
-        publicAnnotations= {key:publicAnnotations[key] for key in publicAnnotations if key not in privateAddedAnnotations}
+        added = _annotation_map(add_annotations, is_private=True)
     else:
-        raise ValueError("You are trying to add private annotations that are already part of the existing public annotations: %s.  Either change the annotation key or specify force=True" % ", ".join([key for key in publicAnnotations if key in privateAddedAnnotations]))
-
-    privateAnnotations.update(privateAddedAnnotations)
-    publicAnnotations.update(publicAddedAnnotations)
-
+        added = _annotation_map(add_annotations)
+
+    changes = {}
+    switched = {True: [], False: []}
+    for key, annotation in added.iteritems():
+        current = existing.get(key)
+        if current == annotation:
+            continue
+        #If you add a private annotation that appears in the public annotation, it switches
+        if current is not None and current[1] != annotation[1]:
+            switched[annotation[1]].append(key)
+        changes[key] = annotation
+
+    if switched[False] and not force:
+        raise ValueError("You are trying to add public annotations that are already part of the existing private annotations: %s.  Either change the annotation key or specify force=True" % ", ".join(switched[False]))
+    if switched[True] and not force:
+        raise ValueError("You are trying to add private annotations that are already part of the existing public annotations: %s.  Either change the annotation key or specify force=True" % ", ".join(switched[True]))
+
+    if not changes:
+        return status, changes
+
+    existing.update(changes)
+    privateAnnotations = {key: value for key, (value, is_private) in existing.iteritems() if is_private}
+    publicAnnotations = {key: value for key, (value, is_private) in existing.iteritems() if not is_private}
     priv = synapseclient.annotations.to_submission_status_annotations(privateAnnotations, is_private=True)
     pub = synapseclient.annotations.to_submission_status_annotations(publicAnnotations, is_private=False)
-
     for annotType in ['stringAnnos', 'longAnnos', 'doubleAnnos']:
-        if priv.get(annotType) is not None and pub.get(annotType) is not None:
-            if pub.get(annotType) is not None:
-                priv[annotType].extend(pub[annotType])
-            else:
-                priv[annotType] = pub[annotType]
-        elif priv.get(annotType) is None and pub.get(annotType) is not None:
-            priv[annotType] = pub[annotType]
+        if pub.get(annotType) is not None:
+            priv.setdefault(annotType, []).extend(pub[annotType])
 
     status.annotations = priv
+    return status, changes
+
+
+def update_single_submission_status(status, add_annotations, force=False):
+    """
+    This will update a single submission's status
+    :param:    Submission status: syn.getSubmissionStatus()
+
+    :param:    Annotations that you want to add in dict or submission status annotations format.
+               If dict, all submissions will be added as private submissions
+    """
+    status, changes = merge_submission_status(status, add_annotations, force=force)
     return(status)
 
-def update_submissions_status_batch(evaluation, statuses):
+def update_submissions_status_batch(evaluation, statuses, reapply=None):
     """
     Update statuses in batch. This can be much faster than individual updates,
     especially in rank based scoring methods which recalculate scores for all
     submissions each time a new submission is received.
 
-    Work on the retry logic and have to pull down the submission statuses
+    If someone else changed any of the statuses meanwhile (412), each one is
+    fetched again and passed to reapply, which makes the same change to it
+    and returns it, or returns None to leave it as it is. The batch is then
+    retried, up to BATCH_UPLOAD_RETRY_COUNT times before the error is
+    raised. Without reapply the error is raised straight away, rather than
+    overwriting the other change.
     """
+    from synapseclient.exceptions import SynapseHTTPError
 
     for retry in range(BATCH_UPLOAD_RETRY_COUNT):
         try:
@@ -161,13 +293,65 @@ def update_submissions_status_batch(evaluation, statuses):
                 response = syn.restPUT("/evaluation/%s/statusBatch" % evaluation.id, json.dumps(batch))
                 token = response.get('nextUploadToken', None)
                 offset += BATCH_SIZE
+            return
         except SynapseHTTPError as err:
             # on 412 ConflictingUpdateException we want to retry
-            if err.response.status_code == 412:
-                # sys.stderr.write('%s, retrying...\n' % err.message)
-                time.sleep(2)
-            else:
+            if err.response.status_code != 412 or reapply is None or retry == BATCH_UPLOAD_RETRY_COUNT - 1:
                 raise
+            sys.stderr.write('%s, retrying on the current statuses...\n' % err.message)
+            time.sleep(2)
+            current_statuses = []
+            for status in statuses:
+                current = reapply(syn.getSubmissionStatus(status.id))
+                if current is None:
+                    sys.stderr.write('submission %s was changed meanwhile; leaving it as it is\n' % status.id)
+                else:
+                    current_statuses.append(current)
+            statuses = current_statuses
+
+
+class StatusWriter(object):
+    """
+    Merges annotations into submission statuses, keeping track of which
+    statuses actually changed, and stores just those in batches through the
+    statusBatch endpoint on flush().
+    """
+    def __init__(self, evaluation, dry_run=False):
+        self.evaluation = evaluation
+        self.dry_run = dry_run
+        self.changed = []
+        self.merged = {}
+        self.dirty_keys = {}
+        self.unchanged = 0
+
+    def update(self, status, add_annotations, force=False):
+        status, changes = merge_submission_status(status, add_annotations, force=force)
+        if changes:
+            self.changed.append(status)
+            self.merged[status.id] = (add_annotations, force)
+            for key in changes:
+                self.dirty_keys[key] = self.dirty_keys.get(key, 0) + 1
+        else:
+            self.unchanged += 1
+        return status, changes
+
+    def flush(self):
+        if self.changed and not self.dry_run:
+            update_submissions_status_batch(self.evaluation, self.changed, reapply=self._reapply)
+        print "%s %d changed statuses, skipped %d unchanged" % (
+            "would store" if self.dry_run else "stored", len(self.changed), self.unchanged)
+        for key, count in sorted(self.dirty_keys.iteritems()):
+            print "    %s: %d" % (key, count)
+        self.changed = []
+        self.merged = {}
+        self.dirty_keys = {}
+        self.unchanged = 0
+
+    def _reapply(self, status):
+        """Merge the same annotations into a status someone else changed"""
+        add_annotations, force = self.merged[status.id]
+        status, changes = merge_submission_status(status, add_annotations, force=force)
+        return status
 
 
 class Query(object):
@@ -203,42 +387,191 @@ class Query(object):
         self.offset += 1
         return values
 
+def _send_journaled(stage, submission_id, message):
+    """
+    Send a (messages function name, kwargs) pair and note it in the journal.
+    In digest mode the message is only noted once _send_digests() has sent
+    it, so a run that dies first sends it again on resuming.
+    """
+    name, kwargs = message
+    with _digest_lock:
+        getattr(messages, name)(**kwargs)
+        if messages.digest:
+            _digested.append((stage, submission_id))
+            return
+    journal.record(stage, submission_id, 'messaged')
+
+
+def _send_digests():
+    """Send the held digests, then note their messages sent in the journal"""
+    with _digest_lock:
+        messages.send_digests()
+        for stage, submission_id in _digested:
+            journal.record(stage, submission_id, 'messaged')
+        del _digested[:]
+
+
+def _resume_messages(stage, evaluation):
+    """Send the messages a crashed run stored statuses for but never sent"""
+    for submission_id, job in journal.in_state(stage, evaluation.id, 'stored'):
+        print "sending message for", submission_id, "left over from an earlier run"
+        _send_journaled(stage, submission_id, job['send'])
+
+
+def _check(evaluation, submission, annotations):
+    """
+    Run the challenge's checker on a downloaded submission.
+
+    :returns: (is_valid, message, participant_error), where participant_error
+              is False if the checker itself failed
+    """
+    ex1 = None #Must define ex1 in case there is no error
+    delay = scheduler.queue_delay(submission)
+    tracing.record('queue_delay', delay, queue=evaluation.id, submission=submission.id)
+    print "validating", submission.id, submission.name, "after waiting %.0f minutes" % (delay/60)
+    try:
+        with tracing.span('validate', queue=evaluation.id, submission=submission.id):
+            is_valid, validation_message = conf.validate_submission(syn, evaluation, submission, annotations)
+    except apicalls.BudgetExceeded:
+        ## not the submission's fault; stop the run instead
+        raise
+    except Exception as ex1:
+        is_valid = False
+        print "Exception during validation:", type(ex1), ex1, ex1.message
+        traceback.print_exc()
+        validation_message = str(ex1)
+    return is_valid, validation_message, isinstance(ex1, AssertionError)
+
+
+def _check_remotely(evaluation, submission, status, annotations, priority=0):
+    """
+    Collect a worker's verdict on a submission from the work queue, or
+    publish a job for it if there's none yet. Workers take jobs with a
+    smaller priority first.
+
+    :returns: (is_valid, message, participant_error), or None if the
+              submission is still waiting for a worker
+    """
+    ## a reset submission has a new etag, and so a new job
+    key = '%s.%s' % (submission.id, status.etag)
+    entry = work_queue.result(key)
+    if entry is None:
+        if work_queue.publish(key, dict(queue=evaluation.id, submission=submission.id, annotations=annotations), priority):
+            print "queued", submission.id, submission.name, "for a worker"
+        return None
+    ## the result is kept until it expires, so a dry run's verdicts are
+    ## reused by the next real run
+    result = entry['result']
+    if 'error' in result:
+        print "giving up on", submission.id, submission.name + ":", result['error']
+        return False, result['error'], False
+    print "checked", submission.id, submission.name, "on", entry['worker']
+    return result['is_valid'], result['message'], result['participant_error']
+
+
+def work(poll_interval=WORKER_POLL_INTERVAL):
+    """
+    Claim jobs from the work queue and run the checker on them until SIGTERM
+    or SIGINT, posting the verdicts back for the coordinator to store.
+    """
+    stopping = threading.Event()
+    def stop(signum, frame):
+        print "\nreceived signal", signum, "- finishing the running job and shutting down"
+        stopping.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    name = workqueue.worker_name()
+    evaluations = {}
+    print "worker", name, "taking jobs from", work_queue.dir
+    sys.stdout.flush()
+    while not stopping.is_set():
+        entry = work_queue.claim(name)
+        if entry is None:
+            stopping.wait(poll_interval)
+            continue
+        job = entry['job']
+        heartbeat = workqueue.Heartbeat(work_queue, entry)
+        heartbeat.start()
+        try:
+            if job['queue'] not in evaluations:
+                evaluations[job['queue']] = syn.getEvaluation(job['queue'])
+            with tracing.span('get_submission', queue=job['queue'], submission=job['submission']):
+                submission = syn.getSubmission(job['submission'])
+            is_valid, validation_message, participant_error = _check(evaluations[job['queue']], submission, job['annotations'])
+        except Exception as ex1:
+            heartbeat.stop()
+            traceback.print_exc()
+            if not heartbeat.lost.is_set():
+                ## let another worker try it now rather than when the
+                ## lease runs out
+                work_queue.release(entry)
+            if isinstance(ex1, apicalls.BudgetExceeded):
+                raise
+            ## and don't take it straight back
+            stopping.wait(poll_interval)
+            continue
+        heartbeat.stop()
+        if heartbeat.lost.is_set():
+            print "lost the lease on", job['submission'], "- another worker has it"
+        else:
+            work_queue.complete(entry, dict(is_valid=is_valid, message=validation_message,
+                                            participant_error=participant_error))
+        sys.stdout.flush()
+
+
 def validate(evaluation, canCancel, dry_run=False):
+    import synapseclient
 
-    if type(evaluation) != Evaluation:
-        evaluation = syn.getEvaluation(evaluation)
+    evaluation = _get_evaluation(evaluation)
 
     print "\n\nValidating", evaluation.id, evaluation.name
     print "-" * 60
     sys.stdout.flush()
 
-    for submission, status in syn.getSubmissionBundles(evaluation, status='RECEIVED'):
+    with tracing.span('list_bundles', queue=evaluation.id):
+        bundles = list(syn.getSubmissionBundles(evaluation, status='RECEIVED'))
+    get_identities().prefetch_submissions([submission for submission, status in bundles])
+    if submission_scheduler is not None:
+        bundles = submission_scheduler.order(bundles, estimate=runtimes.estimator(evaluation.id))
+
+    ## a previous run may have stored statuses, then died before messaging
+    _resume_messages('validate', evaluation)
+    if work_queue is not None and work_queue.expire():
+        print "gave stalled jobs back to the work queue"
+
+    for position, (submission, status) in enumerate(bundles):
+
+        job = journal.start('validate', submission.id, evaluation.id, status.etag)
 
         ## refetch the submission so that we get the file path
-        ## to be later replaced by a "downloadFiles" flag on getSubmissionBundles
-        submission = syn.getSubmission(submission)
+        ## to be later replaced by a "downloadFiles" flag on getSubmissionBundles;
+        ## with a work queue, the worker downloads it instead
+        with tracing.span('get_submission', queue=evaluation.id, submission=submission.id):
+            submission = syn.getSubmission(submission, downloadFile=work_queue is None)
         annotations = {'workflow':evaluation.name.replace("GA4GH-DREAM_","")}
         #Fill in team annotation
-        profile = syn.getUserProfile(submission.userId)
-        annotations['user'] = get_user_name(profile)
+        annotations['user'] = get_identities().user_name(submission.userId)
         if 'teamId' in submission:
-            team = syn.getTeam(submission.teamId)
-            if 'name' in team:
-                annotations['team'] = team['name']
-            else:
-                annotations['team'] = submission.teamId
+            annotations['team'] = get_identities().team_name(submission.teamId)
         else:
             annotations['team'] = annotations['user']
 
-        ex1 = None #Must define ex1 in case there is no error
-        print "validating", submission.id, submission.name
-        try:
-            is_valid, validation_message = conf.validate_submission(syn, evaluation, submission, annotations)
-        except Exception as ex1:
-            is_valid = False
-            print "Exception during validation:", type(ex1), ex1, ex1.message
-            traceback.print_exc()
-            validation_message = str(ex1)
+        if job['state'] == 'checked':
+            ## the checker already ran on this version of the submission
+            print "resuming", submission.id, submission.name, "from journal"
+            is_valid, validation_message, participant_error = job['is_valid'], job['message'], job['participant_error']
+        else:
+            if work_queue is None:
+                is_valid, validation_message, participant_error = _check(evaluation, submission, annotations)
+            else:
+                ## workers follow the scheduled order
+                checked = _check_remotely(evaluation, submission, status, annotations, priority=position)
+                if checked is None:
+                    continue
+                is_valid, validation_message, participant_error = checked
+            journal.record('validate', submission.id, 'checked', is_valid=is_valid,
+                           message=validation_message, participant_error=participant_error)
         ## fill in team in submission status annotations
         status.status = "VALIDATED" if is_valid else "INVALID"
         if canCancel:
@@ -254,45 +587,58 @@ def validate(evaluation, canCancel, dry_run=False):
         add_annotations = synapseclient.annotations.to_submission_status_annotations(annotations,is_private=False)
         status = update_single_submission_status(status, add_annotations)
 
-        if not dry_run:
-            status = syn.store(status)
-        ## send message AFTER storing status to ensure we don't get repeat messages
-        profile = syn.getUserProfile(submission.userId)
         if is_valid:
-            messages.validation_passed(
+            message = ('validation_passed', dict(
                 userIds=[submission.userId],
-                username=get_user_name(profile),
+                status_etag=job['etag'],
+                username=annotations['user'],
                 queue_name=evaluation.name,
                 submission_id=submission.id,
-                submission_name=submission.name)
+                submission_name=submission.name))
         else:
-            if isinstance(ex1, AssertionError):
+            if participant_error:
                 sendTo = [submission.userId]
-                username = get_user_name(profile)
+                username = annotations['user']
             else:
                 sendTo = conf.ADMIN_USER_IDS
                 username = "Challenge Administrator"
 
-            messages.validation_failed(
+            message = ('validation_failed', dict(
                 userIds= sendTo,
+                status_etag=job['etag'],
                 username=username,
                 queue_name=evaluation.name,
                 submission_id=submission.id,
                 submission_name=submission.name,
-                message=validation_message)
+                message=validation_message))
+
+        if not dry_run:
+            with tracing.span('store_status', queue=evaluation.id, submission=submission.id):
+                status = syn.store(status)
+            journal.record('validate', submission.id, 'stored', send=message)
+        ## send message AFTER storing status to ensure we don't get repeat messages
+        _send_journaled('validate', submission.id, message)
+
+    return len(bundles)
 
 
 def validate_reports(evaluation, canCancel, dry_run=False):
+    import synapseclient
 
-    if type(evaluation) != Evaluation:
-        evaluation = syn.getEvaluation(evaluation)
+    evaluation = _get_evaluation(evaluation)
 
     print "\n\nValidating reports", evaluation.id, evaluation.name
     print "-" * 60
     sys.stdout.flush()
 
-    for submission, status in syn.getSubmissionBundles(evaluation, status='VALIDATED'):
+    with tracing.span('list_bundles', queue=evaluation.id):
+        bundles = list(syn.getSubmissionBundles(evaluation, status='VALIDATED'))
+    get_identities().prefetch(user_ids=[submission.userId for submission, status in bundles])
+
+    updated = 0
+    for submission, status in bundles:
         print("checking report status for submission {}".format(submission.id))
+        status_etag = status.etag
         #if submission.id not in ['9621705', '9617386', '9622674']:
         #     continue
 
@@ -305,47 +651,69 @@ def validate_reports(evaluation, canCancel, dry_run=False):
 
         ## refetch the submission so that we get the file path
         ## to be later replaced by a "downloadFiles" flag on getSubmissionBundles
-        submission = syn.getSubmission(submission)
+        with tracing.span('get_submission', queue=evaluation.id, submission=submission.id):
+            submission = syn.getSubmission(submission)
 
 
         ex1 = None #Must define ex1 in case there is no error
         new_report = False
         print "validating report", submission.id, submission.name
         try:
-            report, report_message, new_report = conf.validate_submission_report(syn, evaluation, submission, status_annotations, dry_run)
+            with tracing.span('validate_report', queue=evaluation.id, submission=submission.id):
+                report, report_message, new_report = conf.validate_submission_report(syn, evaluation, submission, status_annotations, dry_run)
 
             print "checked report:", submission.id, submission.name, submission.userId, report
+            if status_annotations.get('reportFailure'):
+                report['reportFailure'] = ''
             add_annotations = synapseclient.annotations.to_submission_status_annotations(report, is_private=False)
-            status = update_single_submission_status(status, add_annotations)
+            status, changes = merge_submission_status(status, add_annotations)
+        except apicalls.BudgetExceeded:
+            raise
         except Exception as ex1:
             print "Exception during report validation:", type(ex1), ex1, ex1.message
             traceback.print_exc()
             report_message = str(ex1)
-
+            changes = None
+            if isinstance(ex1, AssertionError):
+                ## keep the problem with the report on its status, so that
+                ## the participant hears about it once rather than every run
+                add_annotations = synapseclient.annotations.to_submission_status_annotations(
+                    {'reportFailure': report_message}, is_private=False)
+                status, changes = merge_submission_status(status, add_annotations)
+
+        ## reports still being edited usually come back unchanged, as do
+        ## reports failing the same way as last time
+        if not changes:
+            if changes == {}:
+                print "report annotations unchanged; not storing status"
+            continue
+        updated += 1
         if not dry_run:
-            status = syn.store(status)
+            with tracing.span('store_status', queue=evaluation.id, submission=submission.id):
+                status = syn.store(status)
 
         ## send message AFTER storing status to ensure we don't get repeat messages
-        profile = syn.getUserProfile(submission.userId)
+        username = get_identities().user_name(submission.userId)
         if new_report:
             print("sending message for initialized report...")
             messages.report_initialized(
                 userIds=[submission.userId],
-                username=get_user_name(profile),
+                username=username,
                 queue_name=evaluation.name,
                 submission_id=submission.id,
+                status_etag=status_etag,
                 report_entity_id=report['reportEntityId'])
-        elif report['reportStatus'] == 'VALIDATED':
+        elif ex1 is None and report['reportStatus'] == 'VALIDATED':
             messages.report_validation_passed(
                 userIds=[submission.userId],
-                username=get_user_name(profile),
+                username=username,
                 queue_name=evaluation.name,
                 submission_id=submission.id,
+                status_etag=status_etag,
                 report_entity_id=report['reportEntityId'])
         else:
             if isinstance(ex1, AssertionError):
                 sendTo = [submission.userId]
-                username = get_user_name(profile)
             #else:
             #    sendTo = conf.ADMIN_USER_IDS
             #    username = "Challenge Administrator"
@@ -355,28 +723,46 @@ def validate_reports(evaluation, canCancel, dry_run=False):
                     username=username,
                     queue_name=evaluation.name,
                     submission_id=submission.id,
-                    report_entity_id=report['reportEntityId'],
+                    status_etag=status_etag,
+                    report_entity_id=status_annotations.get('reportEntityId', ''),
                     message=report_message)
 
+    return updated
+
 def score(evaluation, canCancel, dry_run=False):
+    import synapseclient
 
-    if type(evaluation) != Evaluation:
-        evaluation = syn.getEvaluation(evaluation)
+    evaluation = _get_evaluation(evaluation)
 
     print '\n\nScoring ', evaluation.id, evaluation.name
     print "-" * 60
     sys.stdout.flush()
 
-    for submission, status in syn.getSubmissionBundles(evaluation, status='VALIDATED'):
+    ## if there's a table configured, batch up updates to it
+    leaderboard_writer = None
+    if not dry_run and evaluation.id in conf.leaderboard_tables:
+        leaderboard_writer = LeaderboardWriter(conf.leaderboard_tables[evaluation.id])
+
+    with tracing.span('list_bundles', queue=evaluation.id):
+        bundles = list(syn.getSubmissionBundles(evaluation, status='VALIDATED'))
+    get_identities().prefetch(user_ids=[submission.userId for submission, status in bundles])
+
+    _resume_messages('score', evaluation)
+
+    scored = []
+    for submission, status in bundles:
 
+        job = journal.start('score', submission.id, evaluation.id, status.etag)
         status.status = "INVALID"
 
         ## refetch the submission so that we get the file path
         ## to be later replaced by a "downloadFiles" flag on getSubmissionBundles
-        submission = syn.getSubmission(submission)
+        with tracing.span('get_submission', queue=evaluation.id, submission=submission.id):
+            submission = syn.getSubmission(submission)
 
         try:
-            score, message = conf.score_submission(evaluation, submission)
+            with tracing.span('score', queue=evaluation.id, submission=submission.id):
+                score, message = conf.score_submission(evaluation, submission)
 
             print "scored:", submission.id, submission.name, submission.userId, score
             add_annotations = synapseclient.annotations.to_submission_status_annotations(score,is_private=True)
@@ -385,9 +771,11 @@ def score(evaluation, canCancel, dry_run=False):
             status.status = "SCORED"
             ### Add in DATE as a public annotation and change team annotation to not private
             ## if there's a table configured, update it
-            if not dry_run and evaluation.id in conf.leaderboard_tables:
-                update_leaderboard_table(conf.leaderboard_tables[evaluation.id], submission, fields=score, dry_run=False)
+            if leaderboard_writer is not None:
+                leaderboard_writer.add(submission, fields=score)
 
+        except apicalls.BudgetExceeded:
+            raise
         except Exception as ex1:
             sys.stderr.write('\n\nError scoring submission %s %s:\n' % (submission.name, submission.id))
             st = StringIO()
@@ -398,36 +786,59 @@ def score(evaluation, canCancel, dry_run=False):
 
             if conf.ADMIN_USER_IDS:
                 submission_info = "submission id: %s\nsubmission name: %s\nsubmitted by user id: %s\n\n" % (submission.id, submission.name, submission.userId)
-                messages.error_notification(userIds=conf.ADMIN_USER_IDS, message=submission_info+st.getvalue())
-
-        if not dry_run:
-            status = syn.store(status)
-
-        ## send message AFTER storing status to ensure we don't get repeat messages
-        profile = syn.getUserProfile(submission.userId)
+                messages.error_notification(userIds=conf.ADMIN_USER_IDS, message=submission_info+st.getvalue(),
+                                            queue_name=evaluation.name)
 
         if status.status == 'SCORED':
-            messages.scoring_succeeded(
+            message = ('scoring_succeeded', dict(
                 userIds=[submission.userId],
+                status_etag=job['etag'],
                 message=message,
-                username=get_user_name(profile),
+                username=get_identities().user_name(submission.userId),
                 queue_name=evaluation.name,
                 submission_name=submission.name,
-                submission_id=submission.id)
+                submission_id=submission.id))
         else:
-            messages.scoring_error(
+            message = ('scoring_error', dict(
                 userIds=conf.ADMIN_USER_IDS,
+                status_etag=job['etag'],
                 message=message,
                 username="Challenge Administrator,",
                 queue_name=evaluation.name,
                 submission_name=submission.name,
-                submission_id=submission.id)
+                submission_id=submission.id))
+
+        scored.append((submission, status, message))
+        if leaderboard_writer is None or len(scored) >= leaderboard_writer.batch_size:
+            _store_scored(evaluation, scored, leaderboard_writer, dry_run)
+
+    _store_scored(evaluation, scored, leaderboard_writer, dry_run)
 
     sys.stdout.write('\n')
+    return len(bundles)
+
+
+def _store_scored(evaluation, scored, leaderboard_writer, dry_run):
+    """
+    Store the leaderboard rows, then the statuses, then send the messages
+    for a list of (submission, status, message) and empty it. A run that
+    dies before the statuses are stored leaves the submissions VALIDATED,
+    to be scored again and their rows updated by the next run.
+    """
+    if leaderboard_writer is not None:
+        leaderboard_writer.flush()
+    for submission, status, message in scored:
+        if not dry_run:
+            with tracing.span('store_status', queue=evaluation.id, submission=submission.id):
+                status = syn.store(status)
+            journal.record('score', submission.id, 'stored', send=message)
+
+        ## send message AFTER storing status to ensure we don't get repeat messages
+        _send_journaled('score', submission.id, message)
+    del scored[:]
 
 def invalidateSubmission(evaluation, dry_run=False):
-    if type(evaluation) != Evaluation:
-        evaluation = syn.getEvaluation(evaluation)
+    evaluation = _get_evaluation(evaluation)
     for submission, status in syn.getSubmissionBundles(evaluation):
         if status.cancelRequested is True:
             status.status = "INVALID"
@@ -435,21 +846,75 @@ def invalidateSubmission(evaluation, dry_run=False):
 
 
 
+def reset_submissions(evaluation, new_status, from_status=None, submission_ids=None, since=None, until=None, team=None, dry_run=False, bundles=None):
+    """
+    Set the status of the matching submissions in an evaluation queue to
+    new_status, storing them all through the statusBatch endpoint. Each
+    change is printed; with dry_run, nothing is stored.
+
+    :param from_status: only reset submissions with this status
+    :param submission_ids: only reset submissions with these IDs
+    :param since, until: only reset submissions created on or after since
+                         and before until, given as ISO dates such as 2017-11-30
+    :param team: only reset submissions from this team, by name or ID
+    :param bundles: the (submission, status) pairs to look at, rather than
+                    listing the whole queue
+
+    :returns: the IDs of the reset submissions
+    """
+    from synapseclient.annotations import from_submission_status_annotations
+    evaluation = _get_evaluation(evaluation)
+
+    if bundles is None:
+        bundles = syn.getSubmissionBundles(evaluation, status=from_status, limit=100)
+    statuses = []
+    reset_ids = []
+    for submission, status in bundles:
+        if from_status and status.status != from_status:
+            continue
+        if submission_ids is not None and submission.id not in submission_ids:
+            continue
+        ## ISO timestamps compare correctly as strings
+        if since and submission.createdOn < since:
+            continue
+        if until and submission.createdOn >= until:
+            continue
+        if team:
+            annotations = from_submission_status_annotations(status.annotations) if 'annotations' in status else {}
+            if team not in (str(submission.get('teamId')), annotations.get('team')):
+                continue
+        if status.status == new_status:
+            continue
+        print "%s%s: %s => %s" % ("dry-run: " if dry_run else "", submission.id, status.status, new_status)
+        status.status = new_status
+        statuses.append(status)
+        reset_ids.append(submission.id)
+
+    def reapply(status):
+        ## leave submissions that moved on from from_status meanwhile
+        if from_status and status.status != from_status:
+            reset_ids.remove(status.id)
+            return None
+        status.status = new_status
+        return status
+
+    if statuses and not dry_run:
+        update_submissions_status_batch(evaluation, statuses, reapply=reapply)
+    return reset_ids
+
+
 def create_leaderboard_table(name, columns, parent, evaluation, dry_run=False):
+    import synapseclient
     if not dry_run:
         schema = syn.store(Schema(name=name, columns=cols, parent=project))
+    writer = LeaderboardWriter(schema.id, dry_run=dry_run)
     for submission, status in syn.getSubmissionBundles(evaluation):
         annotations = synapseclient.annotations.from_submission_status_annotations(status.annotations) if 'annotations' in status else {}
-        update_leaderboard_table(schema.id, submission, annotations, dry_run)
-
+        writer.add(submission, annotations)
+    writer.flush()
 
-def update_leaderboard_table(leaderboard_table, submission, fields, dry_run=False):
-    """
-    Insert or update a record in a leaderboard table for a submission.
-
-    :param fields: a dictionary including all scoring statistics plus the team name for the submission.
-    """
 
+def _leaderboard_fields(submission, fields):
     ## copy fields from submission
     ## fields should already contain scoring stats
     fields['objectId'] = submission.id
@@ -457,6 +922,88 @@ def update_leaderboard_table(leaderboard_table, submission, fields, dry_run=Fals
     fields['entityId'] = submission.entityId
     fields['versionNumber'] = submission.versionNumber
     fields['name'] = submission.name
+    return fields
+
+
+class LeaderboardWriter(object):
+    """
+    Inserts or updates leaderboard table records for many submissions with
+    a handful of table transactions.
+
+    The objectId -> row index of the table is read once, when the first
+    record is added; added records are held in memory and stored as a single
+    rowset for every batch_size submissions, and for whatever is left over
+    on flush().
+    """
+    def __init__(self, leaderboard_table, batch_size=LEADERBOARD_BATCH_SIZE, dry_run=False):
+        self.leaderboard_table = leaderboard_table
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.pending = OrderedDict()
+        self.rows = None
+
+    def load_index(self):
+        rowset = syn.tableQuery("select * from %s" % self.leaderboard_table, resultsAs="rowset").asRowSet()
+        self.headers = rowset['headers']
+        object_id_index = [col['name'] for col in self.headers].index('objectId')
+        self.rows = {}
+        for row in rowset['rows']:
+            object_id = unicode(row['values'][object_id_index])
+            if object_id in self.rows:
+                ## shouldn't happen
+                raise RuntimeError("Multiple entries in leaderboard table %s for submission %s" % (self.leaderboard_table, object_id))
+            self.rows[object_id] = row
+        ## rows inserted by this writer, whose row IDs we only learn by
+        ## reloading the index
+        self.inserted = set()
+
+    def add(self, submission, fields):
+        """
+        Queue a record for a submission.
+
+        :param fields: a dictionary including all scoring statistics plus the team name for the submission.
+        """
+        fields = _leaderboard_fields(submission, fields)
+        if self.rows is None:
+            self.load_index()
+        if unicode(submission.id) in self.inserted:
+            self.flush()
+            self.load_index()
+        self.pending[unicode(submission.id)] = [fields.get(col['name'], None) for col in self.headers]
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        from synapseclient import Row, RowSet
+        if not self.pending:
+            return
+        rows = []
+        for object_id, values in self.pending.iteritems():
+            existing = self.rows.get(object_id)
+            if existing is None:
+                rows.append(Row(values))
+                self.inserted.add(object_id)
+            else:
+                rows.append(Row(values, rowId=existing['rowId'], versionNumber=existing['versionNumber']))
+        num_updates = sum(1 for object_id in self.pending if object_id in self.rows)
+        if self.dry_run:
+            for row in rows:
+                print "update row "+unicode(row['rowId']) if row.get('rowId') is not None else "insert new row", row['values']
+        else:
+            syn.store(RowSet(headers=self.headers, schema=self.leaderboard_table, rows=rows))
+            print "stored %d leaderboard rows (%d updates, %d inserts) in %s" % (len(rows), num_updates, len(rows)-num_updates, self.leaderboard_table)
+        self.pending.clear()
+
+
+def update_leaderboard_table(leaderboard_table, submission, fields, dry_run=False):
+    """
+    Insert or update a record in a leaderboard table for a submission.
+
+    To update records for many submissions, use a LeaderboardWriter instead.
+
+    :param fields: a dictionary including all scoring statistics plus the team name for the submission.
+    """
+    fields = _leaderboard_fields(submission, fields)
 
     results = syn.tableQuery("select * from %s where objectId=%s" % (leaderboard_table, submission.id), resultsAs="rowset")
     rowset = results.asRowSet()
@@ -482,50 +1029,171 @@ def update_leaderboard_table(leaderboard_table, submission, fields, dry_run=Fals
         return syn.store(rowset)
 
 
-def query(evaluation, columns, out=sys.stdout):
-    """Test the query that will be run to construct the leaderboard"""
+def query_pages(query, limit=EXPORT_PAGE_SIZE, threads=EXPORT_THREADS):
+    """
+    Run a submission query, fetching the pages after the first one
+    concurrently.
 
-    if type(evaluation) != Evaluation:
-        evaluation = syn.getEvaluation(evaluation)
+    :returns: (headers, rows) where rows is an iterator over the values of
+              every row, in query order
+    """
+    first_page = Query(query=query, limit=limit)
+
+    def fetch_page(offset):
+        uri = "/evaluation/submission/query?query=" + urllib.quote_plus("%s limit %s offset %s" % (query, limit, offset))
+        return [row['values'] for row in syn.restGET(uri)['rows']]
+
+    def rows():
+        for row in first_page.rows:
+            yield row['values']
+        pool = ThreadPool(threads)
+        try:
+            ## imap fetches ahead but hands pages back in order
+            for page in pool.imap(fetch_page, range(limit, first_page.totalNumberOfResults, limit)):
+                for values in page:
+                    yield values
+        finally:
+            pool.close()
+
+    return first_page.headers, rows()
+
+
+def _column_formatter(column, typed=False):
+    """
+    Build a function converting a raw query value for the given leaderboard
+    column to its exported form: a string, or when typed is set, a float,
+    int or unicode value as appropriate.
+    """
+    if column['columnType'] == "DOUBLE":
+        if typed:
+            return lambda value: None if value is None else float(value)
+        return lambda value: '' if value is None else "%0.6f" % float(value)
+    elif column['columnType'] == "INTEGER" and typed:
+        return lambda value: None if value is None else int(value)
+    elif typed:
+        return lambda value: None if value is None else unicode(value)
+    return lambda value: '' if value is None else unicode(value).encode('utf-8')
+
+
+def query(evaluation, columns, out=sys.stdout, format='csv'):
+    """
+    Write the leaderboard for an evaluation to out as CSV, JSON lines or
+    Parquet (which requires pandas and pyarrow).
+    """
+
+    evaluation = _get_evaluation(evaluation)
 
     ## Note: Constructing the index on which the query operates is an
     ## asynchronous process, so we may need to wait a bit.
-    results = Query(query="select * from evaluation_%s where status==\"SCORED\"" % evaluation.id)
-
-    ## annotate each column with it's position in the query results, if it's there
-    cols = copy.deepcopy(columns)
-    for column in cols:
-        if column['name'] in results.headers:
-            column['index'] = results.headers.index(column['name'])
-    indices = [column['index'] for column in cols if 'index' in column]
-    column_index = {column['index']:column for column in cols if 'index' in column}
-
-    def column_to_string(row, column_index, i):
-        if column_index[i]['columnType']=="DOUBLE":
-            return "%0.6f"%float(row[i])
-        elif column_index[i]['columnType']=="STRING":
-            return "\"%s\""%unicode(row[i]).encode('utf-8')
-        else:
-            return unicode(row[i]).encode('utf-8')
+    headers, rows = query_pages("select * from evaluation_%s where status==\"SCORED\"" % evaluation.id)
+
+    ## work out, once, where each configured column sits in the query
+    ## results and how to format it
+    cols = [column for column in columns if column['name'] in headers]
+    names = [column['name'] for column in cols]
+    indices = [headers.index(column['name']) for column in cols]
+    formatters = [_column_formatter(column, typed=(format != 'csv')) for column in cols]
+    fields = zip(indices, formatters)
+
+    def format_rows():
+        for row in rows:
+            yield [formatter(row[i]) for i, formatter in fields]
+
+    if format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(names)
+        writer.writerows(format_rows())
+    elif format == 'jsonl':
+        for values in format_rows():
+            out.write(json.dumps(OrderedDict(izip(names, values))))
+            out.write("\n")
+    elif format == 'parquet':
+        import pandas as pd
+        pd.DataFrame.from_records(list(format_rows()), columns=names).to_parquet(out)
+    else:
+        raise ValueError("Unknown leaderboard format: %s" % format)
 
-    ## print leaderboard
-    out.write(",".join([column['name'] for column in cols if 'index' in column]) + "\n")
-    for row in results:
-        out.write(",".join(column_to_string(row, column_index, i) for i in indices))
-        out.write("\n")
 
+def fetch_submission_lists(evaluation_ids, status=None, use_cache=True):
+    """
+    Fetch the LIST_COLUMNS of the submissions to several evaluation queues,
+    running one query per queue concurrently. Results younger than
+    LIST_CACHE_TTL seconds are served from the local cache.
+
+    :returns: an OrderedDict of evaluation ID -> list of submission dicts
+    """
+    def fetch(evaluation_id):
+        query = 'select %s from evaluation_%s' % (', '.join(LIST_COLUMNS), evaluation_id)
+        if status:
+            query += ' where status=="%s"' % status
+        rows = query_cache.get(query) if use_cache else None
+        if rows is None:
+            headers, values = query_pages(query, threads=1)
+            rows = query_cache.set(query, [dict(izip(headers, row)) for row in values])
+        return rows
+
+    pool = ThreadPool(max(1, len(evaluation_ids)))
+    try:
+        return OrderedDict(izip(evaluation_ids, pool.map(fetch, evaluation_ids)))
+    finally:
+        pool.close()
 
-def list_submissions(evaluation, status=None, **kwargs):
-    if isinstance(evaluation, basestring):
-        evaluation = syn.getEvaluation(evaluation)
-    print '\n\nSubmissions for: %s %s' % (evaluation.id, evaluation.name.encode('utf-8'))
-    print '-' * 60
 
-    for submission, status in syn.getSubmissionBundles(evaluation, status=status):
-        print submission.id, submission.createdOn, status.status, submission.name.encode('utf-8'), submission.userId
+def _format_submission(row):
+    created = row.get('createdOn')
+    if created:
+        created = datetime.utcfromtimestamp(int(created)/1000.0).strftime('%Y-%m-%d %H:%M:%S')
+    return [row.get('objectId'), created, row.get('status'), row.get('name'), row.get('userId')]
+
+
+def print_submission_lists(submission_lists, format='table'):
+    if format == 'json':
+        print json.dumps(submission_lists, indent=2)
+        return
+    for evaluation_id, rows in submission_lists.iteritems():
+        queue_info = conf.evaluation_queue_by_id.get(int(evaluation_id), {})
+        print '\n\nSubmissions for: %s %s' % (evaluation_id, queue_info.get('handle', ''))
+        print '-' * 60
+        for row in rows:
+            print u'{:<10} {:<19} {:<10} {} {}'.format(*[u'' if value is None else value for value in _format_submission(row)]).encode('utf-8')
+
+
+def watch_submissions(evaluation_ids, status=None, interval=30, format='table'):
+    """
+    Poll the queues every interval seconds, printing submissions that are
+    new or whose status changed since the previous poll. Stop with Ctrl-C.
+    """
+    last_seen = None
+    try:
+        while True:
+            submission_lists = fetch_submission_lists(evaluation_ids, status=status, use_cache=False)
+            seen = {row['objectId']: row['status']
+                    for rows in submission_lists.itervalues() for row in rows}
+            if last_seen is None:
+                print_submission_lists(submission_lists, format)
+            else:
+                changed = OrderedDict(
+                    (evaluation_id, [row for row in rows if last_seen.get(row['objectId']) != row['status']])
+                    for evaluation_id, rows in submission_lists.iteritems())
+                changed = OrderedDict((evaluation_id, rows) for evaluation_id, rows in changed.iteritems() if rows)
+                if changed:
+                    print "\n", datetime.utcnow().isoformat()
+                    print_submission_lists(changed, format)
+            sys.stdout.flush()
+            last_seen = seen
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def list_submissions(evaluation, status=None, format='table', **kwargs):
+    ## an Evaluation or its ID; avoids loading synapseclient for cached lists
+    evaluation_id = evaluation['id'] if isinstance(evaluation, dict) else evaluation
+    print_submission_lists(fetch_submission_lists([evaluation_id], status=status), format)
 
 
 def list_evaluations(project):
+    import synapseclient.utils as utils
     print '\n\nEvaluations for project: ', utils.id_of(project)
     print '-' * 60
 
@@ -534,7 +1202,146 @@ def list_evaluations(project):
         print "Evaluation: %s" % evaluation.id, evaluation.name.encode('utf-8')
 
 
-def archive(evaluation, archiveType, destination=None, name=None, query=None):
+def _stage_submissions(submission_ids, staging_dir, threads=ARCHIVE_DOWNLOAD_THREADS, staging_size=ARCHIVE_STAGING_SIZE):
+    """
+    Download the files of the given submissions concurrently into a bounded
+    staging area, yielding each submission as soon as its file has arrived.
+    Downloads stall while staging_size finished files are waiting to be
+    consumed, so the caller should remove each file once it's done with it.
+    """
+    pending = Queue()
+    staged = Queue(maxsize=staging_size)
+    for submission_id in submission_ids:
+        pending.put(submission_id)
+
+    def download():
+        while True:
+            submission_id = pending.get()
+            if submission_id is None:
+                return
+            try:
+                download_dir = os.path.join(staging_dir, str(submission_id))
+                staged.put((syn.getSubmission(submission_id, downloadLocation=download_dir), None))
+            except Exception as ex1:
+                staged.put((submission_id, ex1))
+
+    workers = [threading.Thread(target=download) for i in range(threads)]
+    for worker in workers:
+        pending.put(None)
+        worker.daemon = True
+        worker.start()
+
+    for i in range(len(submission_ids)):
+        submission, ex1 = staged.get()
+        if ex1 is not None:
+            sys.stderr.write("Error downloading submission %s\n" % submission)
+            raise ex1
+        yield submission
+
+
+def _open_archive_stream(tar_path, compression):
+    """
+    Open a streaming tar writer on tar_path. For compression in
+    ARCHIVE_COMPRESSORS, the tar stream is piped through an external
+    multithreaded compressor.
+
+    :returns: (tar, close) where close() finishes the archive
+    """
+    import tarfile
+    if compression == 'gz':
+        tar = tarfile.open(tar_path, mode='w|gz')
+        return tar, tar.close
+
+    command, ext = ARCHIVE_COMPRESSORS[compression]
+    out = open(tar_path, 'wb')
+    compressor = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=out)
+    tar = tarfile.open(fileobj=compressor.stdin, mode='w|')
+
+    def close():
+        tar.close()
+        compressor.stdin.close()
+        returncode = compressor.wait()
+        out.close()
+        if returncode != 0:
+            raise RuntimeError("'%s' exited with status %s" % (command[0], returncode))
+    return tar, close
+
+
+def _load_manifest(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def _save_manifest(path, manifest):
+    ## write to a temp file and rename so a crash can't leave a partial manifest
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(path + '.tmp', path)
+
+
+def _copy_writeups(submission_ids, manifest_path, threads=ARCHIVE_COPY_THREADS):
+    """
+    Copy the entity of each submission into its own archive project, several
+    at a time. Each submission's project and copied entities are recorded in
+    the manifest as soon as they're created, so rerunning with the same
+    manifest skips finished copies and reuses projects that were already
+    created rather than making new ones.
+
+    :returns: a dict mapping original entity IDs to their copies
+    """
+    from synapseclient import Project
+    import synapseutils as synu
+    manifest = _load_manifest(manifest_path)
+    manifest_lock = threading.Lock()
+
+    def record(submission_id, **kwargs):
+        with manifest_lock:
+            manifest.setdefault(submission_id, {}).update(kwargs)
+            _save_manifest(manifest_path, manifest)
+
+    def copy_writeup(submission_id):
+        entry = manifest.get(submission_id, {})
+        if entry.get('done'):
+            return entry['copied']
+        for retry in range(ARCHIVE_COPY_RETRY_COUNT):
+            try:
+                submission = syn.getSubmission(submission_id, downloadFile=False)
+                if 'project' not in entry:
+                    projectEntity = Project('Archived %s %s %s %s' % (time.strftime("%Y%m%d"),submission.id,submission.entity.id,submission.entity.name))
+                    record(submission_id, project=syn.store(projectEntity).id)
+                    entry = manifest[submission_id]
+                copied = synu.copy(syn, submission.entity.id, entry['project'], updateExisting=True)
+                record(submission_id, copied=copied, done=True)
+                return copied
+            except Exception as ex1:
+                sys.stderr.write("Error copying submission %s (attempt %d of %d): %s\n" % (submission_id, retry+1, ARCHIVE_COPY_RETRY_COUNT, ex1))
+                if retry+1 == ARCHIVE_COPY_RETRY_COUNT:
+                    raise
+                time.sleep(2**retry)
+
+    todo = [submission_id for submission_id in submission_ids
+            if not manifest.get(submission_id, {}).get('done')]
+    print "copying %d writeups (%d already done, recorded in %s)" % (len(todo), len(submission_ids)-len(todo), manifest_path)
+
+    start = time.time()
+    pool = ThreadPool(threads)
+    try:
+        copies = pool.map(copy_writeup, todo)
+    finally:
+        pool.close()
+    elapsed = time.time() - start
+    num_entities = sum(len(copied) for copied in copies)
+    print "copied %d entities in %0.1f seconds (%0.2f entities/second)" % (num_entities, elapsed, num_entities/elapsed if elapsed > 0 else 0.0)
+
+    toReturn = {}
+    for submission_id in submission_ids:
+        toReturn.update(manifest[submission_id]['copied'])
+    return toReturn
+
+
+def archive(evaluation, archiveType, destination=None, name=None, query=None, compression='gz', threads=ARCHIVE_DOWNLOAD_THREADS, manifest=None):
     """
     Archive the submissions for the given evaluation queue and store them in the destination synapse folder.
 
@@ -542,7 +1349,14 @@ def archive(evaluation, archiveType, destination=None, name=None, query=None):
     :param destination: a synapse folder or its ID
     :param query: a query that will return the desired submissions. At least the ID must be returned.
                   defaults to _select * from evaluation_[EVAL_ID] where status=="SCORED"_.
+    :param compression: 'gz', or one of ARCHIVE_COMPRESSORS to compress with multiple cores
+    :param threads: number of concurrent submission downloads or writeup copies
+    :param manifest: for writeups, a local JSON file recording progress so that
+                     an interrupted run can be resumed
     """
+    import tempfile
+    from synapseclient import File
+    import synapseclient.utils as utils
     tempdir = tempfile.mkdtemp()
     archive_dirname = 'submissions_%s' % utils.id_of(evaluation)
 
@@ -555,40 +1369,157 @@ def archive(evaluation, archiveType, destination=None, name=None, query=None):
         raise ValueError("Can't find the required field \"objectId\" in the results of the query: \"{0}\"".format(query))
     if archiveType == "submission":
         if not name:
-            name = 'submissions_%s.tgz' % utils.id_of(evaluation)
+            ext = ARCHIVE_COMPRESSORS[compression][1] if compression in ARCHIVE_COMPRESSORS else '.tgz'
+            name = 'submissions_%s%s' % (utils.id_of(evaluation), ext)
         tar_path = os.path.join(tempdir, name)
+        staging_dir = os.path.join(tempdir, 'staging')
+        metadata_path = os.path.join(tempdir, 'submission_metadata.csv')
         print "creating tar at:", tar_path
         print results.headers
-        with tarfile.open(tar_path, mode='w:gz') as archive:
-            with open(os.path.join(tempdir, 'submission_metadata.csv'), 'w') as f:
-                f.write( (','.join(hdr for hdr in (results.headers + ['filename'])) + '\n').encode('utf-8') )
-                for result in results:
-                    ## retrieve file into cache and copy it to destination
-                    submission = syn.getSubmission(result[results.headers.index('objectId')])
+
+        ## the query is cheap compared to the downloads, so read all of it up
+        ## front and let the files arrive in whatever order they finish
+        id_index = results.headers.index('objectId')
+        result_by_id = OrderedDict((result[id_index], result) for result in results)
+
+        archive, close_archive = _open_archive_stream(tar_path, compression)
+        try:
+            with open(metadata_path, 'wb') as f:
+                writer = csv.writer(f)
+                writer.writerow([hdr.encode('utf-8') for hdr in results.headers + ['filename']])
+                for submission in _stage_submissions(result_by_id.keys(), staging_dir, threads=threads):
                     prefixed_filename = submission.id + "_" + os.path.basename(submission.filePath)
                     archive.add(submission.filePath, arcname=os.path.join(archive_dirname, prefixed_filename))
-                    line = (','.join(unicode(item) for item in (result+[prefixed_filename]))).encode('utf-8')
-                    print line
-                    f.write(line + '\n')
+                    ## free the staging slot as soon as the file is in the archive
+                    shutil.rmtree(os.path.dirname(submission.filePath), ignore_errors=True)
+                    row = [unicode(item).encode('utf-8') for item in result_by_id[submission.id] + [prefixed_filename]]
+                    print ','.join(row)
+                    writer.writerow(row)
             archive.add(
-                name=os.path.join(tempdir, 'submission_metadata.csv'),
+                name=metadata_path,
                 arcname=os.path.join(archive_dirname, 'submission_metadata.csv'))
+        finally:
+            close_archive()
 
+        ## synapseclient uploads large files in parts
         entity = syn.store(File(tar_path, parent=destination), evaluation_id=utils.id_of(evaluation))
         print("created:", entity.id, entity.name)
         toReturn = entity.id
     else:
-        toReturn = {}
-        for result in results:
-            ## retrieve file into cache and copy it to destination
-            submission = syn.getSubmission(result[results.headers.index('objectId')])
-            projectEntity = Project('Archived %s %s %s %s' % (time.strftime("%Y%m%d"),submission.id,submission.entity.id,submission.entity.name))
-            entity = syn.store(projectEntity)
-            copied = synu.copy(syn, submission.entity.id, entity.id)
-            toReturn.update(copied)
+        if not manifest:
+            manifest = 'archive_%s_writeup.json' % utils.id_of(evaluation)
+        submission_ids = [result[results.headers.index('objectId')] for result in results]
+        toReturn = _copy_writeups(submission_ids, manifest, threads=threads)
     return toReturn
 
 
+def _pending_count(evaluation_id, status):
+    """How many submissions to a queue have the given status, in one small query"""
+    return Query('select objectId from evaluation_%s where status=="%s"' % (evaluation_id, status), limit=1).totalNumberOfResults
+
+
+class Poller(object):
+    """
+    Decides when to next run a stage on a queue, backing off while the
+    queue is idle and coming back quickly after it's had work.
+    """
+    def __init__(self, stage, evaluation, min_interval=SERVE_MIN_INTERVAL, max_interval=SERVE_MAX_INTERVAL):
+        self.stage = stage
+        self.evaluation = evaluation
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.due = time.time()
+
+    def done(self, work):
+        if work:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        self.due = time.time() + self.interval
+
+
+def _serve_job(poller, canCancel):
+    """Run one stage on one queue, returning the amount of work done"""
+    status = SERVE_STAGES[poller.stage]
+    if status is not None and _pending_count(poller.evaluation.id, status) == 0:
+        return 0
+    try:
+        stage = {'validate': validate, 'validate_reports': validate_reports, 'score': score}[poller.stage]
+        return stage(poller.evaluation, canCancel)
+    except apicalls.BudgetExceeded:
+        raise
+    except Exception as ex1:
+        ## keep serving; the failed stage is retried after backing off
+        st = StringIO()
+        traceback.print_exc(file=st)
+        sys.stderr.write('Error in %s of %s:\n%s\n' % (poller.stage, poller.evaluation.id, st.getvalue()))
+        if conf.ADMIN_USER_IDS:
+            messages.error_notification(userIds=conf.ADMIN_USER_IDS, message=st.getvalue(), queue_name=conf.CHALLENGE_NAME)
+        return 0
+    finally:
+        _send_digests()
+        sys.stdout.flush()
+
+
+def serve(evaluation_ids, stages, canCancel=False, workers=SERVE_WORKERS,
+          min_interval=SERVE_MIN_INTERVAL, max_interval=SERVE_MAX_INTERVAL, update_lock=None,
+          trace=None, prometheus=None):
+    """
+    Keep running stages on the given queues until SIGTERM or SIGINT.
+
+    A stage runs on a queue when its Poller says it's due, and at most one
+    stage at a time runs on each queue. On shutdown, stages already running
+    are allowed to finish.
+
+    Every SERVE_SUMMARY_INTERVAL the stage timings are printed, appended to
+    the trace file and written to the Prometheus file, if given, and then
+    reset.
+    """
+    stopping = threading.Event()
+    def stop(signum, frame):
+        print "\nreceived signal", signum, "- finishing running stages and shutting down"
+        stopping.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    ## fetched once and kept for the life of the daemon
+    evaluations = [syn.getEvaluation(evaluation_id) for evaluation_id in evaluation_ids]
+    pollers = [Poller(stage, evaluation, max(min_interval, SERVE_STAGE_MIN_INTERVAL.get(stage, 0)),
+                      max(max_interval, SERVE_STAGE_MIN_INTERVAL.get(stage, 0)))
+               for evaluation in evaluations for stage in stages]
+    running = {}
+    pool = ThreadPool(workers)
+    last_summary = time.time()
+    print "serving", len(evaluations), "queues:", ", ".join(stages)
+    sys.stdout.flush()
+
+    try:
+        while not stopping.is_set():
+            for evaluation_id, (poller, result) in running.items():
+                if result.ready():
+                    del running[evaluation_id]
+                    poller.done(result.get())
+            for poller in pollers:
+                if poller.evaluation.id not in running and poller.due <= time.time():
+                    running[poller.evaluation.id] = (poller, pool.apply_async(_serve_job, (poller, canCancel)))
+            ## keep cron runs from breaking the lock of a live daemon
+            if update_lock is not None:
+                update_lock.refresh()
+            if time.time() - last_summary > SERVE_SUMMARY_INTERVAL:
+                tracing.summary()
+                if trace:
+                    tracing.write_jsonl(trace)
+                if prometheus:
+                    tracing.write_prometheus(prometheus)
+                del tracing.spans[:]
+                last_summary = time.time()
+            stopping.wait(1)
+    finally:
+        pool.close()
+        pool.join()
+
+
 ## ==================================================
 ##  Handlers for commands
 ## ==================================================
@@ -599,52 +1530,105 @@ def command_list(args):
     the evaluation queues associated with a given project.
     """
     if args.all:
-        for queue_info in conf.evaluation_queues:
-            list_submissions(evaluation=queue_info['id'],
-                             status=args.status)
+        evaluation_ids = [str(queue_info['id']) for queue_info in conf.evaluation_queues]
     elif args.challenge_project:
-        list_evaluations(project=args.challenge_project)
+        return list_evaluations(project=args.challenge_project)
     elif args.evaluation:
-        list_submissions(evaluation=args.evaluation,
-                         status=args.status)
+        evaluation_ids = [args.evaluation]
+    else:
+        return list_evaluations(project=conf.CHALLENGE_SYN_ID)
+
+    if args.watch:
+        watch_submissions(evaluation_ids, status=args.status, interval=args.watch, format=args.format)
     else:
-        list_evaluations(project=conf.CHALLENGE_SYN_ID)
+        print_submission_lists(fetch_submission_lists(evaluation_ids, status=args.status), args.format)
 
 
 def command_check_status(args):
-    submission = syn.getSubmission(args.submission)
-    status = syn.getSubmissionStatus(args.submission)
-    evaluation = syn.getEvaluation(submission.evaluationId)
+    ## the submission and its status can be fetched at the same time; the
+    ## evaluation rarely changes, so it's cached
+    pool = ThreadPool(2)
+    try:
+        submission = pool.apply_async(syn.getSubmission, (args.submission,), dict(downloadFile=False))
+        status = syn.getSubmissionStatus(args.submission)
+        submission = submission.get()
+    finally:
+        pool.close()
+    evaluation_key = 'evaluation_%s' % submission.evaluationId
+    evaluation = query_cache.get(evaluation_key, ttl=24*60*60)
+    if evaluation is None:
+        evaluation = query_cache.set(evaluation_key, dict(syn.getEvaluation(submission.evaluationId)))
+    from synapseclient import Evaluation
+    evaluation = Evaluation(**evaluation)
     ## deleting the entity key is a hack to work around a bug which prevents
     ## us from printing a submission
     del submission['entity']
+    if args.format == 'json':
+        print json.dumps(dict(evaluation=evaluation, submission=submission, status=status), indent=2)
+        return
     print unicode(evaluation).encode('utf-8')
     print unicode(submission).encode('utf-8')
     print unicode(status).encode('utf-8')
 
 
+def _fetch_bundles(submission_ids):
+    """(submission, status) pairs for submission IDs, by the ID of their queue; missing IDs are left out"""
+    from synapseclient.exceptions import SynapseHTTPError
+    by_queue = OrderedDict()
+    for submission_id in submission_ids:
+        try:
+            submission = syn.getSubmission(submission_id, downloadFile=False)
+            status = syn.getSubmissionStatus(submission_id)
+        except SynapseHTTPError as ex1:
+            if ex1.response.status_code != 404:
+                raise
+            continue
+        by_queue.setdefault(str(submission.evaluationId), []).append((submission, status))
+    return by_queue
+
+
 def command_reset(args):
     if args.rescore_all:
-        for queue_info in conf.evaluation_queues:
-            for submission, status in syn.getSubmissionBundles(queue_info['id'], status="SCORED"):
-                status.status = args.status
-                if not args.dry_run:
-                    print unicode(syn.store(status)).encode('utf-8')
+        queue_ids = [queue_info['id'] for queue_info in conf.evaluation_queues]
     elif args.rescore:
-        for queue_id in args.rescore:
-            for submission, status in syn.getSubmissionBundles(queue_id, status="SCORED"):
-                status.status = args.status
-                if args.dry_run:
-                    print "dry-run: ", submission.id, status.status
-                else:
-                    print "reset: ", submission.id, status.status
-                    #print unicode(syn.store(status)).encode('utf-8')
+        queue_ids = args.rescore
+    elif args.submission:
+        queue_ids = None
     else:
-        for submission in args.submission:
-            status = syn.getSubmissionStatus(submission)
-            status.status = args.status
-            if not args.dry_run:
-                print unicode(syn.store(status)).encode('utf-8')
+        sys.stderr.write("\nReset command requires submission IDs, --rescore or --rescore-all")
+        return
+
+    ## rescoring resets SCORED submissions unless told otherwise; explicitly
+    ## listed submissions are reset whatever their status
+    from_status = args.from_status
+    if from_status is None and not args.submission:
+        from_status = "SCORED"
+
+    submission_ids = set(str(submission) for submission in args.submission) if args.submission else None
+    ## listed submissions are fetched directly, and reset in one batch per
+    ## queue they turn out to be in
+    bundles_by_queue = {}
+    if submission_ids is not None:
+        bundles_by_queue = _fetch_bundles(submission_ids)
+        if queue_ids is None:
+            queue_ids = bundles_by_queue.keys()
+        queue_ids = [queue_id for queue_id in queue_ids if str(queue_id) in bundles_by_queue]
+    total = 0
+    for queue_id in queue_ids:
+        reset = reset_submissions(queue_id, args.status,
+                                  from_status=from_status,
+                                  submission_ids=submission_ids,
+                                  since=args.since, until=args.until, team=args.team,
+                                  dry_run=args.dry_run,
+                                  bundles=bundles_by_queue.get(str(queue_id)))
+        total += len(reset)
+        if submission_ids is not None:
+            submission_ids -= set(reset)
+            if not submission_ids:
+                break
+    print "%s %d submissions to %s" % ("dry-run: would reset" if args.dry_run else "reset", total, args.status)
+    if submission_ids:
+        sys.stderr.write("\nNo matching submissions found for IDs: %s\n" % ", ".join(sorted(submission_ids)))
 
 
 def command_validate(args):
@@ -675,6 +1659,55 @@ def command_score(args):
         sys.stderr.write("\Score command requires either an evaluation ID or --all to score all queues in the challenge")
 
 
+def command_serve(args):
+    if args.all:
+        evaluation_ids = [queue_info['id'] for queue_info in conf.evaluation_queues]
+    elif args.evaluation:
+        evaluation_ids = args.evaluation
+    else:
+        sys.stderr.write("\nServe command requires either evaluation IDs or --all to serve all queues in the challenge")
+        return
+    serve(evaluation_ids, args.stages, canCancel=args.canCancel, workers=args.workers,
+          min_interval=args.min_interval, max_interval=args.max_interval, update_lock=args.update_lock,
+          trace=args.trace, prometheus=args.prometheus)
+
+
+def command_worker(args):
+    if work_queue is None:
+        sys.stderr.write("\nWorker command requires --work-queue, the folder the coordinator publishes jobs to")
+        return
+    ## not opened for commands that don't take the lock
+    if args.runtimes:
+        runtimes.open_history(args.runtimes)
+    work(poll_interval=args.poll_interval)
+
+
+def command_runtimes(args):
+    """
+    Print quantiles of the checker's past wall time and peak memory for
+    each queue, with the fit of wall time to input size.
+    """
+    if not os.path.exists(args.runtimes):
+        print "No checker runs recorded in", args.runtimes
+        return
+    runtimes.open_history(args.runtimes)
+    queue_ids = [args.evaluation] if args.evaluation else runtimes.current.queues()
+    labels = ['p%d' % (q*100) for q in runtimes.RUNTIME_QUANTILES]
+    print "%-10s %-32s %6s %6s  %-24s %-24s %s" % ('queue', 'handle', 'runs', 'failed',
+        'seconds ' + '/'.join(labels), 'peak MB ' + '/'.join(labels), 'seconds per GB')
+    for queue_id in queue_ids:
+        runs = runtimes.runs(queue_id)
+        seconds = runtimes.quantiles(queue_id)
+        max_rss = runtimes.quantiles(queue_id, field='max_rss')
+        line = runtimes.fit(queue_id)
+        print "%-10s %-32s %6d %6d  %-24s %-24s %s" % (
+            queue_id, conf.evaluation_queue_by_id.get(int(queue_id), {}).get('handle', ''),
+            len(runs), sum(1 for run in runs if run['outcome'] != 'passed'),
+            '/'.join('%.0f' % seconds[q] for q in runtimes.RUNTIME_QUANTILES) if seconds else '-',
+            '/'.join('%.0f' % (max_rss[q]/1024.0) for q in runtimes.RUNTIME_QUANTILES) if max_rss else '-',
+            '%.1f' % (line[1] * 1024**3) if line else '-')
+
+
 def command_rank(args):
     raise NotImplementedError('Implement a ranking function for your challenge')
 
@@ -685,15 +1718,19 @@ def command_leaderboard(args):
 
     ## write out to file if --out args given
     if args.out is not None:
-        with open(args.out, 'w') as f:
-            query(args.evaluation, columns=leaderboard_cols, out=f)
+        with open(args.out, 'wb', 1024*1024) as f:
+            query(args.evaluation, columns=leaderboard_cols, out=f, format=args.format)
         print "Wrote leaderboard out to:", args.out
+    elif args.format == 'parquet':
+        sys.stderr.write("\nParquet output requires --out\n")
+        return 2
     else:
-        query(args.evaluation, columns=leaderboard_cols)
+        query(args.evaluation, columns=leaderboard_cols, format=args.format)
 
 
 def command_archive(args):
-    archive(args.evaluation, args.archiveType, args.destination, name=args.name, query=args.query)
+    archive(args.evaluation, args.archiveType, args.destination, name=args.name, query=args.query,
+            compression=args.compression, threads=args.threads, manifest=args.manifest)
 
 
 ## ==================================================
@@ -716,6 +1753,21 @@ def main():
     parser.add_argument("--acknowledge-receipt", help="Send confirmation message on passing validation to participants", action="store_true", default=False)
     parser.add_argument("--dry-run", help="Perform the requested command without updating anything in Synapse", action="store_true", default=False)
     parser.add_argument("--debug", help="Show verbose error output from Synapse API calls", action="store_true", default=False)
+    parser.add_argument("--outbox", metavar="DIR", help="Queue messages in this folder and send them in the background, dropping duplicates", default=None)
+    parser.add_argument("--message-rate", help="Messages per second to send from the outbox", type=float, default=outbox.OUTBOX_DEFAULT_RATE)
+    parser.add_argument("--digest", help="Combine each recipient's messages from this run into a single digest", action="store_true", default=False)
+    parser.add_argument("--escape-html", help="HTML-escape values, such as error messages, filled into message templates", action="store_true", default=False)
+    parser.add_argument("--trace", metavar="FILE", help="Append timings of each pipeline stage to this file as JSON lines", default=None)
+    parser.add_argument("--prometheus", metavar="FILE", help="Write per-queue stage timings to this file for the Prometheus textfile collector", default=None)
+    parser.add_argument("--api-budget", metavar="N", help="Stop after making this many Synapse calls", type=int, default=None)
+    parser.add_argument("--journal", metavar="FILE", help="Record progress on each submission in this SQLite file, so a crashed run can be resumed", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'journal.db'))
+    parser.add_argument("--runtimes", metavar="FILE", help="Record how long the checker takes in this SQLite file", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'runtimes.db'))
+    parser.add_argument("--work-queue", metavar="DIR", help="Leave the checker to worker commands on the hosts sharing this folder", default=None)
+    parser.add_argument("--no-journal", dest="journal", action="store_const", const=None, help="Don't record or resume progress")
+    parser.add_argument("--schedule", metavar="POLICY", nargs='+', default=scheduler.SCHEDULER_DEFAULT_POLICIES,
+                        help="Order submissions for validation by these policies, most important first: %s, or module.ClassName. Use 'arrival' for Synapse's order" % ", ".join(sorted(scheduler.POLICIES)))
+    parser.add_argument("--boost", metavar="ID", nargs='+', default=[], help="Submission, user or team IDs for the admin-boost policy to validate first")
+    parser.add_argument("--api-rate", metavar="RATE", help="Make at most this many Synapse calls per second", type=float, default=None)
 
     subparsers = parser.add_subparsers(title="subcommand")
 
@@ -724,17 +1776,24 @@ def main():
     parser_list.add_argument("--challenge-project", "--challenge", "--project", metavar="SYNAPSE-ID", default=None)
     parser_list.add_argument("-s", "--status", default=None)
     parser_list.add_argument("--all", action="store_true", default=False)
-    parser_list.set_defaults(func=command_list)
+    parser_list.add_argument("--format", choices=['table', 'json'], default='table')
+    parser_list.add_argument("--watch", metavar="SECONDS", type=int, default=None, help="Keep polling, showing new submissions and status changes")
+    parser_list.set_defaults(func=command_list, needs_lock=False)
 
     parser_status = subparsers.add_parser('status', help="Check the status of a submission")
     parser_status.add_argument("submission")
-    parser_status.set_defaults(func=command_check_status)
+    parser_status.add_argument("--format", choices=['text', 'json'], default='text')
+    parser_status.set_defaults(func=command_check_status, needs_lock=False)
 
     parser_reset = subparsers.add_parser('reset', help="Reset a submission to RECEIVED for re-scoring (or set to some other status)")
     parser_reset.add_argument("submission", metavar="SUBMISSION-ID", type=int, nargs='*', help="One or more submission IDs, or omit if using --rescore-all")
     parser_reset.add_argument("-s", "--status", default='RECEIVED')
     parser_reset.add_argument("--rescore-all", action="store_true", default=False)
     parser_reset.add_argument("--rescore", metavar="EVALUATION-ID", type=int, nargs='*', help="One or more evaluation IDs to rescore")
+    parser_reset.add_argument("--from-status", default=None, help="Only reset submissions with this status (default SCORED with --rescore/--rescore-all)")
+    parser_reset.add_argument("--since", metavar="DATE", default=None, help="Only reset submissions created on or after this date, e.g. 2017-11-30")
+    parser_reset.add_argument("--until", metavar="DATE", default=None, help="Only reset submissions created before this date")
+    parser_reset.add_argument("--team", default=None, help="Only reset submissions from this team (name or ID)")
     parser_reset.set_defaults(func=command_reset)
 
     parser_validate = subparsers.add_parser('validate', help="Validate all RECEIVED submissions to an evaluation")
@@ -755,6 +1814,25 @@ def main():
     parser_score.add_argument("--canCancel", action="store_true", default=False)
     parser_score.set_defaults(func=command_score)
 
+    parser_serve = subparsers.add_parser('serve', help="Keep validating submissions and their reports as they arrive, until stopped with SIGTERM")
+    parser_serve.add_argument("evaluation", metavar="EVALUATION-ID", nargs='*', default=None)
+    parser_serve.add_argument("--all", action="store_true", default=False)
+    parser_serve.add_argument("--canCancel", action="store_true", default=False)
+    parser_serve.add_argument("--stages", choices=SERVE_STAGES.keys(), nargs='+', default=SERVE_DEFAULT_STAGES,
+                              help="Stages to run, by default %s" % " and ".join(SERVE_DEFAULT_STAGES))
+    parser_serve.add_argument("--workers", type=int, default=SERVE_WORKERS, help="Number of stages to run at once")
+    parser_serve.add_argument("--min-interval", type=float, default=SERVE_MIN_INTERVAL, help="Seconds between polls of a busy queue")
+    parser_serve.add_argument("--max-interval", type=float, default=SERVE_MAX_INTERVAL, help="Most seconds between polls of an idle queue")
+    parser_serve.set_defaults(func=command_serve)
+
+    parser_worker = subparsers.add_parser('worker', help="Run the checker on jobs from --work-queue, until stopped with SIGTERM")
+    parser_worker.add_argument("--poll-interval", type=float, default=WORKER_POLL_INTERVAL, help="Seconds between looks for a job while idle")
+    parser_worker.set_defaults(func=command_worker, needs_lock=False)
+
+    parser_runtimes = subparsers.add_parser('runtimes', help="Summarize how long the checker has taken on each queue")
+    parser_runtimes.add_argument("evaluation", metavar="EVALUATION-ID", nargs='?', default=None)
+    parser_runtimes.set_defaults(func=command_runtimes, needs_lock=False)
+
     parser_rank = subparsers.add_parser('rank', help="Rank all SCORED submissions to an evaluation")
     parser_rank.add_argument("evaluation", metavar="EVALUATION-ID", default=None)
     parser_rank.set_defaults(func=command_rank)
@@ -765,11 +1843,15 @@ def main():
     parser_archive.add_argument("destination", metavar="FOLDER-ID", default=None)
     parser_archive.add_argument("-q", "--query", default=None)
     parser_archive.add_argument("-n", "--name", default=None)
+    parser_archive.add_argument("--compression", choices=['gz'] + sorted(ARCHIVE_COMPRESSORS), default='gz', help="Use pigz or zstd to compress on multiple cores")
+    parser_archive.add_argument("--threads", type=int, default=ARCHIVE_DOWNLOAD_THREADS, help="Number of submissions to download or writeups to copy at once")
+    parser_archive.add_argument("--manifest", default=None, help="Local file recording writeup copy progress; rerun with the same file to resume")
     parser_archive.set_defaults(func=command_archive)
 
     parser_leaderboard = subparsers.add_parser('leaderboard', help="Print the leaderboard for an evaluation")
     parser_leaderboard.add_argument("evaluation", metavar="EVALUATION-ID", default=None)
     parser_leaderboard.add_argument("--out", default=None)
+    parser_leaderboard.add_argument("--format", choices=['csv', 'jsonl', 'parquet'], default='csv')
     parser_leaderboard.set_defaults(func=command_leaderboard)
 
     args = parser.parse_args()
@@ -777,9 +1859,13 @@ def main():
     print "\n" * 2, "=" * 75
     print datetime.utcnow().isoformat()
 
-    ## Acquire lock, don't run two scoring scripts at once
+    ## Acquire lock, don't run two scoring scripts at once; read-only
+    ## commands like list and status can run alongside them
+    update_lock = None
+    exit_status = None
     try:
-        update_lock = lock.acquire_lock_or_fail('challenge', max_age=timedelta(hours=4))
+        if getattr(args, 'needs_lock', True):
+            update_lock = lock.acquire_lock_or_fail('challenge', max_age=timedelta(hours=4))
     except lock.LockedException:
         print u"Is the scoring script already running? Can't acquire lock."
         # can't acquire lock, so return error code 75 which is a
@@ -787,12 +1873,9 @@ def main():
         return 75
 
     try:
-        syn = synapseclient.Synapse(debug=args.debug)
-        if not args.user:
-            args.user = os.environ.get('SYNAPSE_USER', None)
-        if not args.password:
-            args.password = os.environ.get('SYNAPSE_PASSWORD', None)
-        syn.login(email=args.user, password=args.password)
+        ## logs in on first use
+        syn = client.LazyClient(user=args.user, password=args.password, debug=args.debug,
+                                budget=args.api_budget, rate=args.api_rate)
 
         ## initialize messages
         messages.syn = syn
@@ -800,8 +1883,33 @@ def main():
         messages.send_messages = args.send_messages
         messages.send_notifications = args.notifications
         messages.acknowledge_receipt = args.acknowledge_receipt
-
-        args.func(args)
+        messages.digest = args.digest
+        messages.escape_values = args.escape_html
+        if args.outbox:
+            messages.use_outbox(args.outbox, rate=args.message_rate)
+        ## read-only commands and dry runs have nothing to resume
+        if args.journal and not args.dry_run and getattr(args, 'needs_lock', True):
+            journal.open_journal(args.journal)
+        ## dry runs still run the checker, so their timings count
+        if args.runtimes and getattr(args, 'needs_lock', True):
+            runtimes.open_history(args.runtimes)
+
+        args.update_lock = update_lock
+
+        global submission_scheduler, work_queue
+        if args.work_queue:
+            work_queue = workqueue.WorkQueue(args.work_queue)
+        if args.schedule != ['arrival']:
+            submission_scheduler = scheduler.Scheduler([
+                scheduler.make_policy(name, submission_ids=args.boost,
+                                      submitters=args.boost + getattr(conf, 'BOOSTED_SUBMITTERS', []))
+                for name in args.schedule])
+
+        exit_status = args.func(args)
+
+    except apicalls.BudgetExceeded as ex1:
+        ## don't spend more calls notifying admins
+        sys.stderr.write('Stopping: %s\n' % ex1)
 
     except Exception as ex1:
         sys.stderr.write('Error in scoring script:\n')
@@ -814,12 +1922,26 @@ def main():
             messages.error_notification(userIds=conf.ADMIN_USER_IDS, message=st.getvalue(), queue_name=conf.CHALLENGE_NAME)
 
     finally:
-        update_lock.release()
+        _send_digests()
+        messages.stop_outbox()
+        journal.close_journal()
+        runtimes.close_history()
+        if update_lock is not None:
+            update_lock.release()
+
+    tracing.summary()
+    if syn is not None:
+        syn.summary()
+    if args.trace:
+        tracing.write_jsonl(args.trace)
+    if args.prometheus:
+        tracing.write_prometheus(args.prometheus)
 
     print "\ndone: ", datetime.utcnow().isoformat()
     print "=" * 75, "\n" * 2
+    return exit_status
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
 
@@ -6,18 +6,20 @@
 import os
 import time
 import traceback
-import subprocess
 import json
 import re
 import shutil
-import zipfile
-import yaml
-import fnmatch
 from datetime import datetime
 from StringIO import StringIO
 from contextlib import contextmanager
-import synapseutils as synu
-from synapseclient import Folder, File, Wiki
+import journal
+import precheck
+import runtimes
+import scheduler
+import tracing
+
+## synapseclient, yaml, zipfile and subprocess are imported by the functions
+## that use them, so that loading the configuration stays quick
 
 # from https://stackoverflow.com/questions/431684/how-do-i-cd-in-python/24176022#24176022
 @contextmanager
@@ -43,6 +45,14 @@ CHALLENGE_NAME = "GA4GH-DREAM Tool Execution Challenge"
 ADMIN_USER_IDS = ['3324230','2223305']
 
 CHALLENGE_OUTPUT_FOLDER = "syn9856439"
+
+## Where the workflow runners are installed; workers on other hosts can
+## point these elsewhere with environment variables
+CWL_RUNNER = os.environ.get('CWL_RUNNER', '/home/ubuntu/.local/bin/cwl-runner')
+CROMWELL_JAR = os.environ.get('CROMWELL_JAR', '/home/ubuntu/ga4gh-dream-challenge/scoring_harness/cromwell-29.jar')
+
+## Optionally, 'precheck' lists rules the output files must pass before the
+## checker is run; see precheck.py
 evaluation_queues = [
     {
         'id':9603664,
@@ -117,6 +127,7 @@ evaluation_queues = [
         'param_ext': '.json',
         'report_src': 'syn10517407',
         'report_dest': 'syn11516211',
+        'precheck': [{'glob': '*.bam', 'min_size': 1024, 'magic': 'bam'}],
     },
     {   'id':9607590,
         'handle': 'broad-gatk-validate-bam',
@@ -159,6 +170,7 @@ def update_params(submissionDir, checkerParamPath, handle):
     Rewrite checker parameters file for workflows with dynamic
     output filenames.
     """
+    import subprocess
     if handle == 'encode_mapping_workflow':
         replace_expr = 's|path.*\"\"|path\": \"{}\"|g'.format(submissionDir)
     elif handle == 'pcawg-sanger-variant-caller':
@@ -172,9 +184,16 @@ def update_params(submissionDir, checkerParamPath, handle):
 
 
 def run_checker(submissionDir, checkerPath, checkerParamPath, outputDir, checker_type):
+    """
+    Run a queue's checker over a submission.
+
+    :returns: the checker's peak memory in kilobytes
+    """
+    import fnmatch
+    import subprocess
     if checker_type == 'cwl':
         validate_command = [
-            '/home/ubuntu/.local/bin/cwl-runner', 
+            CWL_RUNNER, 
             '--non-strict', 
             '--outdir', 
             outputDir, 
@@ -185,7 +204,7 @@ def run_checker(submissionDir, checkerPath, checkerParamPath, outputDir, checker
         validate_command = [
             'java', 
             '-jar',
-            '/home/ubuntu/ga4gh-dream-challenge/scoring_harness/cromwell-29.jar', 
+            CROMWELL_JAR, 
             'run', 
             checkerPath, 
             '--inputs', 
@@ -199,7 +218,9 @@ def run_checker(submissionDir, checkerPath, checkerParamPath, outputDir, checker
             # clear cache
             if 'cromwell-executions' in os.listdir('.'):
                 shutil.rmtree('cromwell-executions')
-            subprocess.call(validate_command)
+            returncode, max_rss = runtimes.call(validate_command)
+            if returncode:
+                print "Checker exited with status {}".format(returncode)
     except OSError as ex:
         print "Exception from '{}' runner:".format(checker_type), type(ex), ex, ex.message
         raise
@@ -219,6 +240,7 @@ def run_checker(submissionDir, checkerPath, checkerParamPath, outputDir, checker
             logFile,
             os.path.join(outputDir, os.path.basename(logFile))
         )
+    return max_rss
 
 
 def validate_submission(syn, evaluation, submission, annotations):
@@ -228,16 +250,30 @@ def validate_submission(syn, evaluation, submission, annotations):
     :returns: (True, message) if validated, (False, message) if
               validation fails or throws exception
     """
+    import zipfile
+    import synapseutils as synu
+    from synapseclient import Folder, File
     config = evaluation_queue_by_id[int(evaluation.id)]
     submissionDir = os.path.dirname(submission.filePath)
-    if submission.filePath.endswith('.zip'):
-        zip_ref = zipfile.ZipFile(submission.filePath, 'r')
-        zip_ref.extractall(submissionDir)
-        zip_ref.close()
-
-    # number and organization outputs will vary for each queue; no simple way
-    # to validate file presence -- can leave it up to the checker
-    # assert all([os.path.exists(os.path.join(submissionDir, actualName)) for actualName in config['filename']]), "Your submitted file or zipped file must contain these file(s): %s" % ",".join(config['filename'])
+    job = journal.entry('validate', submission.id)
+    if submission.filePath.endswith('.zip') and not (job and job['state'] == 'extracted'):
+        with tracing.span('extract', queue=evaluation.id, submission=submission.id):
+            try:
+                zip_ref = zipfile.ZipFile(submission.filePath, 'r')
+                zip_ref.extractall(submissionDir)
+                zip_ref.close()
+            except zipfile.BadZipfile as ex:
+                raise AssertionError("Your submitted zip file could not be extracted ({}). Please check it and resubmit.".format(ex))
+        journal.record('validate', submission.id, 'extracted')
+
+    # number and organization of outputs vary for each queue, so each lists
+    # what its outputs must look like under 'precheck'; catching missing or
+    # malformed outputs here saves running the checker for minutes
+    if config.get('precheck'):
+        with tracing.span('precheck', queue=evaluation.id, submission=submission.id):
+            problems = precheck.check(submissionDir, config['precheck'])
+        if problems:
+            raise AssertionError("Your submitted output(s) failed basic checks before running the {} checker tool:\n{}".format(config['handle'], "\n".join(problems)))
 
     scriptDir = os.path.dirname(os.path.realpath(__file__))
     checkerDir = os.path.join(scriptDir, 'checkers')
@@ -296,20 +332,26 @@ def validate_submission(syn, evaluation, submission, annotations):
     #except OSError as ex:
     #    print "Exception from 'cwl-runner':", type(ex), ex, ex.message
     #    raise
-    run_checker(submissionDir, checkerPath, newCheckerParamPath, outputDir, config['checker_type'])
-
-    # collect checker results
-    resultFile = os.path.join(outputDir,'results.json')
-    logFile = os.path.join(outputDir,'log.txt')
-    with open(resultFile) as data_file:
-        results = json.load(data_file)
-
-    try:
-        overall_status = results['overall']
-    except KeyError:
-        overall_status = results['Overall']
-    except KeyError:
-        print("No 'overall' field found in {}".format(resultFile))
+    # the symlinked known goods don't count towards the input size
+    with runtimes.measure(evaluation.id, submission.id, runner=config['checker_type'],
+                          submitter=scheduler.submitter(submission),
+                          input_bytes=runtimes.directory_size(submissionDir)) as run:
+        with tracing.span('checker', queue=evaluation.id, submission=submission.id):
+            run['max_rss'] = run_checker(submissionDir, checkerPath, newCheckerParamPath, outputDir, config['checker_type'])
+
+        # collect checker results
+        resultFile = os.path.join(outputDir,'results.json')
+        logFile = os.path.join(outputDir,'log.txt')
+        with open(resultFile) as data_file:
+            results = json.load(data_file)
+
+        try:
+            overall_status = results['overall']
+        except KeyError:
+            overall_status = results['Overall']
+        except KeyError:
+            print("No 'overall' field found in {}".format(resultFile))
+        run['outcome'] = 'passed' if overall_status else 'failed'
 
     if not overall_status:
         output = synu.walk(syn, CHALLENGE_OUTPUT_FOLDER)
@@ -336,6 +378,7 @@ def _initialize_report(syn, evaluation, submission):
     """
     Create a dummy Synapse entity and attach wiki for report.
     """
+    from synapseclient import File, Wiki
     config = evaluation_queue_by_id[int(evaluation.id)]
     print("wiki source: {}".format(config['report_src']))
     print("wiki target: {}".format(config['report_dest']))
@@ -374,7 +417,8 @@ def validate_submission_report(syn, evaluation, submission, status_annotations,
             status_annotations['reportStatus'],
 	    status_annotations['reportEntityId']
 	)
-        report_wiki = syn.getWiki(report_id)
+        with tracing.span('get_wiki', queue=evaluation.id, submission=submission.id):
+            report_wiki = syn.getWiki(report_id)
     except:
         report_status, report_id = _initialize_report(syn, evaluation, submission)
         report_wiki = syn.getWiki(report_id)
@@ -395,7 +439,8 @@ def validate_submission_report(syn, evaluation, submission, status_annotations,
         report_msg = "Report appears to have been modified since creation date/time and is in progress."
         print('checking report')
         # validate report
-        report_dict = _parse_wiki_yaml(report_wiki.markdown)
+        with tracing.span('parse_report', queue=evaluation.id, submission=submission.id):
+            report_dict = _parse_wiki_yaml(report_wiki.markdown)
         platform = report_dict['platform']
         environment = report_dict['environment']
 
@@ -428,6 +473,7 @@ def _parse_wiki_yaml(wiki_markdown):
     """
     Parse YAML fields from code chunks in a wiki markdown and return dict.
     """
+    import yaml
     md_lines = StringIO(wiki_markdown).readlines()
     try:
         last_line = [idx for idx, l in enumerate(md_lines) 
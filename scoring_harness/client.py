@@ -0,0 +1,105 @@
+## One place to build the logged-in Synapse client that the harness scripts
+## share.
+##
+## login() gives the client a pooled HTTP session, big enough for the thread
+## pools used by the harness, with keep-alive and compressed responses. It
+## reuses the API key synapseclient remembered on the last run where it can,
+## instead of logging in with the password every time. The client comes
+## back wrapped for call accounting (see apicalls).
+
+import os
+import threading
+
+import apicalls
+
+# connections kept open to Synapse; the largest thread pool in the harness
+# uses this many at once
+CLIENT_POOL_SIZE = 16
+
+# retries of failed connections, not of failed requests
+CLIENT_CONNECT_RETRIES = 3
+
+
+def pooled_session(pool_size=CLIENT_POOL_SIZE):
+    """
+    A requests session that keeps up to pool_size connections alive.
+    Threads wait for a free connection rather than opening extra ones.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=CLIENT_CONNECT_RETRIES, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+    return session
+
+
+def login(user=None, password=None, debug=False, pool_size=CLIENT_POOL_SIZE, budget=None, rate=None):
+    """
+    Log in to Synapse, by default as SYNAPSE_USER with SYNAPSE_PASSWORD.
+
+    :param budget: the most Synapse calls to allow, defaults to SYNAPSE_API_BUDGET
+    :param rate: the most calls per second, defaults to SYNAPSE_API_RATE
+    :returns: an apicalls.CountingSynapse
+    """
+    import synapseclient
+    from synapseclient.exceptions import SynapseAuthenticationError, SynapseHTTPError
+    user = user or os.environ.get('SYNAPSE_USER', None)
+    password = password or os.environ.get('SYNAPSE_PASSWORD', None)
+
+    syn = synapseclient.Synapse(debug=debug)
+    ## synapseclient has no argument for the session; every call goes
+    ## through this one
+    syn._requests_session = pooled_session(pool_size)
+
+    logged_in = False
+    if user:
+        try:
+            ## without a password, synapseclient looks up the API key it
+            ## remembered for the user, in the system keyring
+            syn.login(email=user, silent=True)
+            ## make sure the key still works before relying on it
+            syn.getUserProfile()
+            logged_in = True
+        except (SynapseAuthenticationError, SynapseHTTPError):
+            ## no key, or it was revoked or the password changed; start over
+            pass
+    if not logged_in:
+        ## rememberMe keeps the API key for the next run
+        syn.login(email=user, password=password, rememberMe=True)
+
+    if budget is None and os.environ.get('SYNAPSE_API_BUDGET'):
+        budget = int(os.environ['SYNAPSE_API_BUDGET'])
+    if rate is None and os.environ.get('SYNAPSE_API_RATE'):
+        rate = float(os.environ['SYNAPSE_API_RATE'])
+    return apicalls.CountingSynapse(syn, budget=budget, rate=rate)
+
+
+class LazyClient(object):
+    """
+    Stands in for the client returned by login(), logging in the first time
+    it's used, so commands answered from local caches skip loading
+    synapseclient and logging in.
+    """
+    def __init__(self, **login_args):
+        self.__dict__['_login_args'] = login_args
+        self.__dict__['_client'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                self.__dict__['_client'] = login(**self._login_args)
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self._get_client(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_client(), name, value)
+
+    def summary(self, *args, **kwargs):
+        if self._client is not None:
+            self._client.summary(*args, **kwargs)
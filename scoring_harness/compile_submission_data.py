@@ -1,11 +1,20 @@
+import csv
 import os
 import sys
 import re
+from itertools import izip
+from multiprocessing.pool import ThreadPool
 
 import synapseclient
 from synapseclient import Evaluation, Submission, SubmissionStatus
 import challenge_config as conf
 import challenge as chal
+import client
+
+# how many report wikis to fetch and write out at once
+REPORT_THREADS = 8
+
+REPORT_TABLE_COLUMNS = ['workflow', 'file', 'content', 'submission_id']
 
 
 def collect_report_data(syn, report_id):
@@ -19,69 +28,109 @@ def collect_report_data(syn, report_id):
     return report_dict, report_wiki.markdown
 
 
-def update_submissions(syn, evaluation, out_folder, annotation_keys=None):
+def update_submissions(syn, evaluation, out_folder, annotation_keys=None, threads=REPORT_THREADS):
+    """
+    Write the report wiki of each VALIDATED submission as markdown under
+    out_folder and copy its fields into the submission annotations. Wikis
+    are fetched, parsed and written out on a thread pool.
+
+    :returns: a list of [workflow, file, content, submission_id] rows, one
+              per report
+    """
     if type(evaluation) != Evaluation:
         evaluation = syn.getEvaluation(evaluation)
-    
+
+    handle = conf.evaluation_queue_by_id[int(evaluation.id)]['handle']
+    out_subfolder = os.path.join(out_folder, handle)
+
+    validated = []
     for submission, status in syn.getSubmissionBundles(evaluation, status='VALIDATED', limit=100):
 	print("> checking report status for submission {}".format(submission.id))
         status_annotations = {annot['key']: annot['value']
                               for annot in status['annotations']['stringAnnos']}
-        report_status, report_id = (
-            status_annotations['reportStatus'],
-            status_annotations['reportEntityId']
-        )
-        if report_status != 'VALIDATED':
-            continue
- 
-        report_dict, report_markdown = collect_report_data(syn, report_id)
-
-        out_subfolder = os.path.join(
-            out_folder,
-            conf.evaluation_queue_by_id[int(evaluation.id)]['handle'], 
+        if status_annotations['reportStatus'] == 'VALIDATED':
+            validated.append((submission, status, status_annotations))
+    if validated and not os.path.exists(out_subfolder):
+        os.mkdir(out_subfolder)
+
+    def export_report(bundle):
+        submission, status, status_annotations = bundle
+        report_dict, report_markdown = collect_report_data(
+            syn, status_annotations['reportEntityId']
         )
-        if not os.path.exists(out_subfolder):
-            os.mkdir(out_subfolder)
-
         report_md_path = os.path.join(out_subfolder,
                                       '{}_report.md'.format(submission.id))
         with open(report_md_path, 'w') as f:
             f.write(report_markdown.encode('utf-8'))
-
-        if annotation_keys is None:
-            get_keys = [key for key in report_dict.keys()
-                        if not re.search('_ex$', key)]
-        else:
-            get_keys = annotation_keys
-
-        for key in get_keys:
-            current_annotation = status_annotations.get(key, None)
-            if current_annotation != report_dict[key]:
-                status_annotations[key] = report_dict[key]
-                print("...updating '{}': '{}' => '{}'"
-                      .format(key, current_annotation, 
-                              status_annotations[key].encode('utf-8')))
-
-        add_annotations = synapseclient.annotations.to_submission_status_annotations(
-            status_annotations, is_private=False
-        )
-        status = chal.update_single_submission_status(status, add_annotations)
-        syn.store(status)
+        return report_dict, report_markdown, os.path.basename(report_md_path)
+
+    report_rows = []
+    status_writer = chal.StatusWriter(evaluation)
+    pool = ThreadPool(threads)
+    try:
+        ## reports come back in submission order while later ones are
+        ## still being fetched
+        exported = pool.imap(export_report, validated)
+        for (submission, status, status_annotations), (report_dict, report_markdown, report_file) in izip(validated, exported):
+            report_rows.append([handle, report_file, report_markdown, submission.id])
+
+            if annotation_keys is None:
+                get_keys = [key for key in report_dict.keys()
+                            if not re.search('_ex$', key)]
+            else:
+                get_keys = annotation_keys
+
+            for key in get_keys:
+                current_annotation = status_annotations.get(key, None)
+                if current_annotation != report_dict[key]:
+                    status_annotations[key] = report_dict[key]
+                    print("...updating '{}': '{}' => '{}'"
+                          .format(key, current_annotation,
+                                  status_annotations[key].encode('utf-8')))
+
+            add_annotations = synapseclient.annotations.to_submission_status_annotations(
+                status_annotations, is_private=False
+            )
+            status_writer.update(status, add_annotations)
+    finally:
+        pool.close()
+    status_writer.flush()
     print("done.")
+    return report_rows
+
+
+def write_report_table(report_rows, path):
+    """
+    Write all reports to a single table, as Parquet if path ends in
+    '.parquet' (requires pandas and pyarrow) or as CSV otherwise.
+    """
+    if path.endswith('.parquet'):
+        import pandas as pd
+        pd.DataFrame.from_records(report_rows, columns=REPORT_TABLE_COLUMNS).to_parquet(path)
+    else:
+        with open(path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(REPORT_TABLE_COLUMNS)
+            writer.writerows([unicode(value).encode('utf-8') for value in row]
+                             for row in report_rows)
+    print("wrote {} reports to {}".format(len(report_rows), path))
 
 
 def main(argv):
-    syn = synapseclient.Synapse()
-    user = os.environ.get('SYNAPSE_USER', None)
-    password = os.environ.get('SYNAPSE_PASSWORD', None)
-    syn.login(email=user, password=password)
+    syn = client.login()
+    chal.syn = syn
 
     project_id = conf.CHALLENGE_SYN_ID
     out_folder = argv[0]
+    report_table_path = (argv[1] if len(argv) > 1
+                         else os.path.join(out_folder, 'report_wiki_df.csv'))
+    report_rows = []
     for queue_info in conf.evaluation_queues:
         print("backfilling submission annotations for queue {}..."
               .format(queue_info['id']))
-        update_submissions(syn, queue_info['id'], out_folder)
+        report_rows += update_submissions(syn, queue_info['id'], out_folder)
+    write_report_table(report_rows, report_table_path)
+    syn.summary()
 
 
 if __name__ == '__main__':
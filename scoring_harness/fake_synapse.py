@@ -0,0 +1,359 @@
+## An in-process stand-in for the parts of the Synapse client used by the
+## scoring harness, for measuring the harness without the live service.
+##
+## A FakeSynapse holds a synthetic challenge -- evaluation queues, submission
+## bundles, statuses with etags, report wikis, tables and sent messages --
+## and counts every call made to it. Each call can be made to take a fixed
+## amount of time to approximate network latency.
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import urlparse
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+import synapseclient
+from synapseclient import Evaluation, Submission, SubmissionStatus, Wiki
+from synapseclient.exceptions import SynapseHTTPError
+
+QUERY_REGEX = re.compile(r'select (.+?) from evaluation_(\d+)(?: where (.+?))? limit (\d+) offset (\d+)$')
+CONDITION_REGEX = re.compile(r'(\w+)\s*==\s*"([^"]*)"')
+
+## fields every submission has in query results, besides its annotations
+QUERY_FIELDS = ['objectId', 'scopeId', 'status', 'createdOn', 'modifiedOn', 'userId',
+                'submitterId', 'teamId', 'name', 'entityId', 'versionNumber']
+
+REPORT_TEMPLATE = """\
+## Submission overview
+
+```YAML
+name: "{name}"
+institution: "Institution {team}"
+platform: "{platform}"
+workflow_type: "CWL"
+runner_version: "1.0"
+docker_version: "17.06.0-ce"
+environment: "{environment}"
+env_cpus: "8"
+env_memory: "32Gb"
+env_disk: "100Gb"
+```
+
+## Steps
+
+Ran the workflow.
+"""
+
+
+class _Response(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def _api(method):
+    """Count a call to a fake API method and wait out the simulated latency"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            self.calls[method.__name__] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _iso(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+class FakeSynapse(object):
+    """
+    A synthetic challenge with num_submissions submissions spread over the
+    given evaluation queue IDs, all with the given status.
+
+    :param report_status: if given, each submission gets a report wiki and
+                          'reportStatus'/'reportEntityId' annotations
+    :param latency: seconds each API call takes
+    """
+    def __init__(self, evaluation_ids, num_submissions, status='RECEIVED',
+                 report_status=None, latency=0.0, project_id='syn8507133'):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.project_id = project_id
+        self.next_id = 100000000
+        self.messages = []
+        self.entities = {}
+        self.wikis = {}
+        self.tables = {}
+        ## query results by query and statuses version, so that paging
+        ## through a query builds its rows only once
+        self.statuses_version = 0
+        self.query_results = {}
+        self.tempdir = tempfile.mkdtemp()
+        self.submission_file = os.path.join(self.tempdir, 'output.txt')
+        with open(self.submission_file, 'w') as f:
+            f.write('submission output\n')
+
+        self.evaluations = OrderedDict(
+            (str(evaluation_id), Evaluation(id=str(evaluation_id),
+                                            name='GA4GH-DREAM_queue_%s' % evaluation_id,
+                                            contentSource=project_id,
+                                            status='OPEN'))
+            for evaluation_id in evaluation_ids)
+        self.submissions = OrderedDict()
+        self.statuses = {}
+        start = datetime(2017, 7, 1)
+        evaluation_ids = self.evaluations.keys()
+        for i in range(num_submissions):
+            submission_id = str(9600000 + i)
+            user_id = str(3300000 + i % max(1, num_submissions // 5))
+            created = start + timedelta(minutes=i)
+            submission = dict(
+                id=submission_id,
+                evaluationId=evaluation_ids[i % len(evaluation_ids)],
+                entityId='syn%d' % (20000000 + i),
+                versionNumber=1,
+                userId=user_id,
+                name='submission %d' % i,
+                createdOn=_iso(created))
+            if i % 3:
+                submission['teamId'] = str(3350000 + i % max(1, num_submissions // 20))
+            self.submissions[submission_id] = submission
+
+            annotations = {'workflow': 'queue_%s' % submission['evaluationId'],
+                           'user': 'User %s' % user_id,
+                           'team': 'Team %s' % submission.get('teamId', user_id)}
+            if report_status is not None:
+                report_id = self._new_id()
+                annotations.update(reportStatus=report_status, reportEntityId=report_id)
+                if report_status == 'VALIDATED':
+                    annotations.update(platform=['cwltool', 'toil', 'rabix'][i % 3],
+                                       environment=['EC2', 'local', 'GCP'][i % 3])
+                self.wikis[report_id] = dict(
+                    owner=report_id,
+                    markdown=REPORT_TEMPLATE.format(name=annotations['user'],
+                                                    team=annotations['team'],
+                                                    platform=['cwltool', 'toil', 'rabix'][i % 3],
+                                                    environment=['EC2', 'local', 'GCP'][i % 3]),
+                    createdOn=_iso(created),
+                    modifiedOn=_iso(created + timedelta(days=1)))
+            self.statuses[submission_id] = dict(
+                id=submission_id,
+                status=status,
+                etag='etag-0',
+                modifiedOn=_iso(created),
+                annotations=synapseclient.annotations.to_submission_status_annotations(annotations, is_private=False))
+
+    def _new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return 'syn%d' % self.next_id
+
+    ## ------------------------------------------------------------------
+    ## evaluations and submissions
+    ## ------------------------------------------------------------------
+
+    @_api
+    def getEvaluation(self, id):
+        return Evaluation(**self.evaluations[str(synapseclient.utils.id_of(id))])
+
+    @_api
+    def getEvaluationByContentSource(self, entity):
+        return [Evaluation(**evaluation) for evaluation in self.evaluations.itervalues()]
+
+    def _status(self, submission_id):
+        return SubmissionStatus(**json.loads(json.dumps(self.statuses[submission_id])))
+
+    def getSubmissionBundles(self, evaluation, status=None, limit=20):
+        evaluation_id = str(synapseclient.utils.id_of(evaluation))
+        matching = [submission_id for submission_id, submission in self.submissions.iteritems()
+                    if submission['evaluationId'] == evaluation_id and
+                    (status is None or self.statuses[submission_id]['status'] == status)]
+        ## one call per page, like the real client
+        for offset in range(0, len(matching), limit):
+            self._get_bundle_page()
+            for submission_id in matching[offset:offset+limit]:
+                yield Submission(**self.submissions[submission_id]), self._status(submission_id)
+
+    @_api
+    def _get_bundle_page(self):
+        pass
+
+    @_api
+    def getSubmission(self, id, downloadFile=True, downloadLocation=None, **kwargs):
+        submission_id = str(synapseclient.utils.id_of(id))
+        if submission_id not in self.submissions:
+            raise SynapseHTTPError('404 Client Error: no submission %s' % submission_id, response=_Response(404))
+        submission = Submission(**self.submissions[submission_id])
+        submission['entity'] = dict(id=submission.entityId, name='entity %s' % submission.id)
+        if downloadFile:
+            if downloadLocation:
+                if not os.path.exists(downloadLocation):
+                    os.makedirs(downloadLocation)
+                submission['filePath'] = os.path.join(downloadLocation, 'output.txt')
+                with open(submission['filePath'], 'w') as f:
+                    f.write('submission output\n')
+            else:
+                submission['filePath'] = self.submission_file
+        return submission
+
+    @_api
+    def getSubmissionStatus(self, submission):
+        submission_id = str(synapseclient.utils.id_of(submission))
+        if submission_id not in self.statuses:
+            raise SynapseHTTPError('404 Client Error: no submission %s' % submission_id, response=_Response(404))
+        return self._status(submission_id)
+
+    def _store_status(self, status):
+        current = self.statuses[status['id']]
+        if status.get('etag') != current['etag']:
+            raise SynapseHTTPError('412 Client Error: etag mismatch for %s' % status['id'], response=_Response(412))
+        stored = json.loads(json.dumps(status))
+        stored['etag'] = 'etag-%d' % (int(current['etag'].split('-')[1]) + 1)
+        self.statuses[status['id']] = stored
+        self.statuses_version += 1
+        return SubmissionStatus(**stored)
+
+    ## ------------------------------------------------------------------
+    ## REST calls
+    ## ------------------------------------------------------------------
+
+    @_api
+    def restGET(self, uri):
+        path, _, query = uri.partition('?')
+        if path == '/evaluation/submission/query':
+            return self._query(urlparse.parse_qs(query)['query'][0])
+        raise ValueError("FakeSynapse can't GET %s" % uri)
+
+    @_api
+    def restPUT(self, uri, body=None):
+        match = re.match(r'/evaluation/(\d+)/statusBatch', uri)
+        if match:
+            batch = json.loads(body)
+            for status in batch['statuses']:
+                self._store_status(status)
+            return {'nextUploadToken': 'token'}
+        raise ValueError("FakeSynapse can't PUT %s" % uri)
+
+    @_api
+    def restPOST(self, uri, body=None):
+        ids = json.loads(body)['list']
+        if uri == '/userProfile':
+            return {'list': [self._profile(id) for id in ids]}
+        elif uri == '/teamList':
+            return {'list': [self._team(id) for id in ids]}
+        raise ValueError("FakeSynapse can't POST %s" % uri)
+
+    def _query_row(self, submission_id):
+        submission = self.submissions[submission_id]
+        status = self.statuses[submission_id]
+        row = dict(objectId=submission_id,
+                   scopeId=submission['evaluationId'],
+                   status=status['status'],
+                   createdOn=str(int((datetime.strptime(submission['createdOn'], '%Y-%m-%dT%H:%M:%S.%fZ') - datetime(1970, 1, 1)).total_seconds() * 1000)),
+                   modifiedOn=str(int(time.time() * 1000)),
+                   userId=submission['userId'],
+                   submitterId=submission.get('teamId', submission['userId']),
+                   teamId=submission.get('teamId'),
+                   name=submission['name'],
+                   entityId=submission['entityId'],
+                   versionNumber=str(submission['versionNumber']))
+        row.update(synapseclient.annotations.from_submission_status_annotations(status['annotations']))
+        return row
+
+    def _query(self, query):
+        match = QUERY_REGEX.match(query.strip())
+        if not match:
+            raise ValueError("FakeSynapse can't run query: %s" % query)
+        columns, evaluation_id, where, limit, offset = match.groups()
+        key = (columns, evaluation_id, where, self.statuses_version)
+        if key not in self.query_results:
+            conditions = CONDITION_REGEX.findall(where or '')
+            queue_rows = [self._query_row(submission_id) for submission_id, submission in self.submissions.iteritems()
+                          if submission['evaluationId'] == evaluation_id]
+            rows = [row for row in queue_rows if all(unicode(row.get(key)) == value for key, value in conditions)]
+            if columns.strip() == '*':
+                headers = sorted(set(QUERY_FIELDS).union(key for row in queue_rows for key in row))
+            else:
+                headers = [column.strip() for column in columns.split(',')]
+            ## only the latest results are paged through
+            self.query_results = {key: (headers, rows)}
+        headers, rows = self.query_results[key]
+        page = rows[int(offset):int(offset)+int(limit)]
+        return {'totalNumberOfResults': len(rows),
+                'headers': headers,
+                'rows': [{'values': [None if row.get(header) is None else unicode(row[header]) for header in headers]}
+                         for row in page]}
+
+    ## ------------------------------------------------------------------
+    ## users and teams
+    ## ------------------------------------------------------------------
+
+    def _profile(self, user_id):
+        return {'ownerId': str(user_id), 'userName': 'user%s' % user_id,
+                'firstName': 'User', 'lastName': str(user_id)}
+
+    def _team(self, team_id):
+        return {'id': str(team_id), 'name': 'Team %s' % team_id}
+
+    @_api
+    def getUserProfile(self, id=None):
+        return self._profile(id)
+
+    @_api
+    def getTeam(self, id):
+        return self._team(id)
+
+    ## ------------------------------------------------------------------
+    ## entities, wikis, tables and messages
+    ## ------------------------------------------------------------------
+
+    @_api
+    def store(self, obj, **kwargs):
+        if isinstance(obj, SubmissionStatus):
+            return self._store_status(obj)
+        if isinstance(obj, Wiki):
+            self.wikis[obj.ownerId] = dict(obj)
+            return obj
+        if isinstance(obj, (synapseclient.table.TableAbstractBaseClass, synapseclient.table.RowSet)):
+            schema = synapseclient.utils.id_of(obj.schema) if isinstance(obj.schema, basestring) else obj.schema
+            self.tables.setdefault(str(getattr(schema, 'id', schema)), []).append(obj)
+            return obj
+        if not obj.get('id'):
+            obj['id'] = self._new_id()
+        self.entities[obj['id']] = obj
+        return obj
+
+    @_api
+    def get(self, entity, **kwargs):
+        entity_id = synapseclient.utils.id_of(entity)
+        if entity_id in self.entities:
+            return self.entities[entity_id]
+        return synapseclient.Project(name='Project %s' % entity_id, id=entity_id)
+
+    @_api
+    def getChildren(self, parent, includeTypes=None, **kwargs):
+        return iter([])
+
+    @_api
+    def getWiki(self, owner, subpageId=None):
+        wiki = self.wikis[synapseclient.utils.id_of(owner)]
+        result = Wiki(owner=wiki['owner'], markdown=wiki['markdown'])
+        result['createdOn'] = wiki['createdOn']
+        result['modifiedOn'] = wiki['modifiedOn']
+        return result
+
+    @_api
+    def sendMessage(self, userIds, messageSubject, messageBody, contentType="text/plain"):
+        self.messages.append((userIds, messageSubject))
+        return {'id': len(self.messages)}
+
+    @_api
+    def setPermissions(self, entity, principalId=None, accessType=None, **kwargs):
+        pass
@@ -0,0 +1,80 @@
+import json
+import os
+
+from cache import TTLCache
+
+# how long user and team names are cached, in seconds
+IDENTITY_CACHE_TTL = 24*60*60
+
+# how many IDs to look up per batch request
+IDENTITY_BATCH_SIZE = 100
+
+IDENTITY_CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cache', 'identities')
+
+
+def get_user_name(profile):
+    names = []
+    if 'firstName' in profile and profile['firstName'] and profile['firstName'].strip():
+        names.append(profile['firstName'])
+    if 'lastName' in profile and profile['lastName'] and profile['lastName'].strip():
+        names.append(profile['lastName'])
+    if len(names)==0:
+        names.append(profile['userName'])
+    return " ".join(names)
+
+
+class IdentityResolver(object):
+    """
+    Resolves Synapse user and team IDs to display names, looking up many IDs
+    per request and keeping the results in memory and in a persistent
+    TTLCache shared between runs.
+    """
+    def __init__(self, syn, cache=None):
+        self.syn = syn
+        self.cache = cache if cache is not None else TTLCache(IDENTITY_CACHE_DIR, ttl=IDENTITY_CACHE_TTL)
+        self.names = {}
+
+    def _fetch(self, kind, ids, uri):
+        """Batch-fetch objects not already known, caching their names"""
+        keys = {'%s_%s' % (kind, id): str(id) for id in ids}
+        missing = [key for key in keys if key not in self.names]
+        self.names.update(self.cache.get_many(missing))
+        missing = [keys[key] for key in missing if key not in self.names]
+        for offset in range(0, len(missing), IDENTITY_BATCH_SIZE):
+            batch = missing[offset:offset+IDENTITY_BATCH_SIZE]
+            response = self.syn.restPOST(uri, json.dumps({'list': batch}))
+            for obj in response['list']:
+                if kind == 'user':
+                    name = get_user_name(obj)
+                    id = obj['ownerId']
+                else:
+                    name = obj.get('name', obj['id'])
+                    id = obj['id']
+                key = '%s_%s' % (kind, id)
+                self.names[key] = self.cache.set(key, name)
+
+    def prefetch(self, user_ids=(), team_ids=()):
+        """Look up the names of all the given users and teams at once"""
+        if user_ids:
+            self._fetch('user', set(user_ids), '/userProfile')
+        if team_ids:
+            self._fetch('team', set(team_ids), '/teamList')
+
+    def user_name(self, user_id):
+        key = 'user_%s' % user_id
+        if key not in self.names:
+            self.prefetch(user_ids=[user_id])
+        return self.names.get(key, str(user_id))
+
+    def team_name(self, team_id):
+        key = 'team_%s' % team_id
+        if key not in self.names:
+            self.prefetch(team_ids=[team_id])
+        ## fall back to the ID, as for teams without a name
+        return self.names.get(key, team_id)
+
+    def prefetch_submissions(self, submissions):
+        """Look up the submitters and teams of the given submissions"""
+        self.prefetch(user_ids=[submission.userId for submission in submissions],
+                      team_ids=[submission.teamId for submission in submissions
+                                if 'teamId' in submission])
@@ -0,0 +1,132 @@
+## A write-ahead journal of the work done on each submission, so that a run
+## that dies part way through can be picked up where it stopped.
+##
+## Each (stage, submission) has one entry that moves through the states in
+## STATES as the work is done, carrying whatever is needed to carry on from
+## there -- the checker's verdict once 'checked', the message to send once
+## 'stored'. An entry belongs to the submission status it started from,
+## identified by its etag, so a submission that's reset starts over.
+##
+## Like tracing, the journal is module level state: call open_journal() once
+## per run, then record() and entry() are no-ops if no journal was opened.
+
+import json
+import sqlite3
+import threading
+import time
+
+STATES = ['fetched', 'extracted', 'checked', 'stored', 'messaged']
+
+# finished entries older than this many seconds are dropped on open
+JOURNAL_RETENTION = 30*24*60*60
+
+SCHEMA = """
+create table if not exists jobs (
+    stage text not null,
+    submission_id text not null,
+    queue text,
+    etag text,
+    state text not null,
+    data text not null,
+    updated real not null,
+    primary key (stage, submission_id)
+)
+"""
+
+## Module level state
+current = None
+
+
+class Journal(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        ## readers don't block the writer, and a crashed process can't
+        ## leave a half-written entry behind
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute("pragma synchronous=normal")
+        self.db.execute(SCHEMA)
+        self.db.execute("delete from jobs where state='messaged' and updated < ?",
+                        (time.time() - JOURNAL_RETENTION,))
+
+    def start(self, stage, submission_id, queue, etag):
+        """
+        Return the entry for a submission, starting a new one in state
+        'fetched' unless there's one for the same status etag to resume.
+        """
+        found = self.entry(stage, submission_id)
+        if found is not None and found['etag'] == etag:
+            return found
+        with self.lock:
+            self.db.execute("insert or replace into jobs values (?, ?, ?, ?, 'fetched', '{}', ?)",
+                            (stage, str(submission_id), str(queue), etag, time.time()))
+        return dict(state='fetched', etag=etag, queue=str(queue))
+
+    def record(self, stage, submission_id, state, **data):
+        """Move an entry on to state, adding data to what's recorded"""
+        with self.lock:
+            row = self.db.execute("select data from jobs where stage=? and submission_id=?",
+                                  (stage, str(submission_id))).fetchone()
+            if row is None:
+                return
+            merged = json.loads(row[0])
+            merged.update(data)
+            self.db.execute("update jobs set state=?, data=?, updated=? where stage=? and submission_id=?",
+                            (state, json.dumps(merged), time.time(), stage, str(submission_id)))
+
+    def entry(self, stage, submission_id):
+        with self.lock:
+            row = self.db.execute("select queue, etag, state, data from jobs where stage=? and submission_id=?",
+                                  (stage, str(submission_id))).fetchone()
+        if row is None:
+            return None
+        return dict(json.loads(row[3]), queue=row[0], etag=row[1], state=row[2])
+
+    def in_state(self, stage, queue, state):
+        """(submission ID, entry) pairs of a queue's entries in the given state"""
+        with self.lock:
+            rows = self.db.execute("select submission_id, etag, data from jobs where stage=? and queue=? and state=? order by updated",
+                                   (stage, str(queue), state)).fetchall()
+        return [(submission_id, dict(json.loads(data), queue=str(queue), etag=etag, state=state))
+                for submission_id, etag, data in rows]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def open_journal(path):
+    global current
+    current = Journal(path)
+    return current
+
+
+def close_journal():
+    global current
+    if current is not None:
+        current.close()
+        current = None
+
+
+def start(stage, submission_id, queue, etag):
+    if current is None:
+        return dict(state='fetched', etag=etag, queue=str(queue))
+    return current.start(stage, submission_id, queue, etag)
+
+
+def record(stage, submission_id, state, **data):
+    if current is not None:
+        current.record(stage, submission_id, state, **data)
+
+
+def entry(stage, submission_id):
+    if current is None:
+        return None
+    return current.entry(stage, submission_id)
+
+
+def in_state(stage, queue, state):
+    if current is None:
+        return []
+    return current.in_state(stage, queue, state)
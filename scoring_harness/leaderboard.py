@@ -1,11 +1,17 @@
 import sys
 import urllib
 import copy
+import re
 
 import pandas as pd
 from synapseclient import Evaluation
 
 
+## cells made up only of printable ASCII (minus backslash) come out of
+## 'unicode-escape' unchanged, so anything else needs escaping
+NEEDS_ESCAPE_REGEX = re.compile(r'[^\x20-\x5b\x5d-\x7e]')
+
+
 class Query(object):
     """
     An object that helps with paging through annotation query results.
@@ -54,3 +60,25 @@ def leaderboardQuery(syn, evaluation):
 
     query = 'select * from evaluation_{}'.format(evaluation.id)
     return Query(syn, query).to_dataframe() 
+
+
+def normalize_text_columns(df):
+    """
+    Replace missing values with empty strings and 'unicode-escape' any
+    text that wouldn't survive a push to a Synapse table, operating on
+    whole columns. Only object columns are considered, and within those
+    only the cells that actually contain non-ASCII (or escapable) text
+    are rewritten.
+    """
+    df = df.replace([None], '')
+    for col in df.columns[df.dtypes == object]:
+        values = df[col].astype(unicode)
+        ## one regex scan over the joined column is enough to rule out
+        ## the (common) all-ASCII case
+        if NEEDS_ESCAPE_REGEX.search(u''.join(values)) is not None:
+            needs_escape = values.str.contains(NEEDS_ESCAPE_REGEX)
+            values[needs_escape] = (values[needs_escape]
+                                    .str.encode('unicode-escape')
+                                    .str.decode('utf-8'))
+        df[col] = values
+    return df
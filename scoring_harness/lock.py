@@ -58,6 +58,11 @@ class Lock(object):
                 self.held = False
         return self.held
 
+    def refresh(self):
+        """Reset the age of a held lock, so that long runs don't lose it"""
+        if self.held:
+            os.utime(self.lock_dir_path, (0, time.time()))
+
     def release(self):
         """Release lock or do nothing if lock is not held"""
         if self.held:
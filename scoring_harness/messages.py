@@ -1,8 +1,15 @@
 ## Messages for challenge scoring script.
 
+import cgi
+import hashlib
 import string
 import sys
+import uuid
 import warnings
+from collections import OrderedDict
+
+from outbox import Outbox, Sender
+import tracing
 
 
 ## Module level state. You'll need to set a synapse object at least
@@ -13,11 +20,29 @@ send_notifications = True
 acknowledge_receipt = False
 dry_run = False
 
+## Set with use_outbox() to queue messages on disk and send them from a
+## background thread rather than sending them inline
+outbox = None
+sender = None
+
+## When set, messages are held per recipient until send_digests() is called
+## and then sent as one digest per recipient
+digest = False
+_digests = OrderedDict()
+
+## HTML-escape the values filled into message templates
+escape_values = False
+
+## Identifies this run in the outbox keys of messages that don't say which
+## submission status they're about
+run_id = uuid.uuid4().hex[:12]
+
 
 ## Edit these URLs to point to your challenge and its support forum
 defaults = dict(
     challenge_instructions_url = "https://www.synapse.org/syn8507133",
     support_forum_url = "https://www.synapse.org/#!Synapse:syn8507133/discussion/default",
+    challenge_name = "GA4GH-DREAM Tool Execution Challenge",
     scoring_script = "GA4GH-DREAM Admins")
 
 ##---------------------------------------------------------
@@ -186,6 +211,17 @@ submission ID: <b>{submission_id}</b></p>
 {scoring_script}</p>
 """
 
+digest_subject_template = "{count} updates on your {challenge_name} submissions"
+digest_template = """\
+<p>There have been {count} updates on your submissions to the {challenge_name}:</p>
+
+{messages}
+"""
+digest_separator = "\n<hr>\n"
+digest_entry_template = """\
+<h3>{subject}</h3>
+{message}"""
+
 notification_subject_template = "Exception while scoring submission to {queue_name}"
 error_notification_template = """\
 <p>Hello Challenge Administrator,</p>
@@ -220,6 +256,77 @@ class DefaultingFormatter(string.Formatter):
 
 formatter = DefaultingFormatter()
 
+
+class CompiledTemplate(object):
+    """
+    A message template parsed once into alternating literal text and field
+    names, so rendering is a lookup per field and a join. Before anything
+    is rendered, every field must be given in the arguments or the module
+    defaults, or a ValueError names the missing ones. A field given as None
+    is still rendered as {field}, with a warning, like DefaultingFormatter.
+    Templates with attribute/index lookups, conversions or format specs
+    fall back to DefaultingFormatter.
+    """
+    def __init__(self, template):
+        self.template = template
+        self.parts = []
+        self.fields = set()
+        self.names = set()
+        self.simple = True
+        for literal, field, format_spec, conversion in formatter.parse(template):
+            self.parts.append((_text(literal), field))
+            if field is not None:
+                self.fields.add(field)
+                ## the argument name, without attribute or index lookups
+                self.names.add(field.partition('.')[0].partition('[')[0])
+                if format_spec or conversion or not field or '.' in field or '[' in field:
+                    self.simple = False
+
+    def check(self, kwargs):
+        """Raise a ValueError if the arguments and defaults leave out any fields"""
+        ## defaults may be changed by the challenge after import
+        missing = [name for name in self.names if name not in kwargs and name not in defaults]
+        if missing:
+            raise ValueError("Missing template variables %s for template %r" % (", ".join(sorted(missing)), self.template[:40]))
+
+    def render(self, kwargs, escape=False):
+        self.check(kwargs)
+        if not self.simple:
+            return formatter.format(self.template, **kwargs)
+        values = {}
+        for field in self.fields:
+            ## like DefaultingFormatter, an explicit None isn't defaulted
+            value = kwargs[field] if field in kwargs else defaults.get(field)
+            if value is None:
+                value = "{{{0}}}".format(field)
+                warnings.warn("Missing template variable %s" % value)
+            else:
+                value = _text(value)
+                if escape:
+                    value = cgi.escape(value)
+            values[field] = value
+        return u''.join(literal + (u'' if field is None else values[field])
+                        for literal, field in self.parts)
+
+
+def _text(value):
+    """A template value as unicode; byte strings, such as tracebacks, are taken as UTF-8"""
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return unicode(value)
+
+_compiled_templates = {}
+
+def compile_template(template):
+    """Return the CompiledTemplate for a template string, parsing it only once"""
+    compiled = _compiled_templates.get(template)
+    if compiled is None:
+        compiled = _compiled_templates[template] = CompiledTemplate(template)
+    return compiled
+
+def render(template, kwargs, escape=False):
+    return compile_template(template).render(kwargs, escape)
+
 ##---------------------------------------------------------
 ## functions for sending various types of messages
 ##---------------------------------------------------------
@@ -229,83 +336,168 @@ def validation_failed(userIds, **kwargs):
         return send_message(userIds=userIds, 
                             subject_template=validation_failed_subject_template,
                             message_template=validation_failed_template,
-                            kwargs=kwargs)
+                            kwargs=kwargs,
+                            template_name='validation_failed')
 
 def validation_passed(userIds, **kwargs):
     if acknowledge_receipt:
         return send_message(userIds=userIds,
                             subject_template=validation_passed_subject_template,
                             message_template=validation_passed_template,
-                            kwargs=kwargs)
+                            kwargs=kwargs,
+                            template_name='validation_passed')
 
 def report_initialized(userIds, **kwargs):
     if send_messages:
         return send_message(userIds=userIds, 
                             subject_template=report_initialized_subject_template,
                             message_template=report_initialized_template,
-                            kwargs=kwargs)
+                            kwargs=kwargs,
+                            template_name='report_initialized')
 
 def report_reminder(userIds, **kwargs):
     if send_messages:
         return send_message(userIds=userIds, 
                             subject_template=report_reminder_subject_template,
                             message_template=report_reminder_template,
-                            kwargs=kwargs)
+                            kwargs=kwargs,
+                            template_name='report_reminder')
 
 def report_validation_failed(userIds, **kwargs):
     if send_messages:
         return send_message(userIds=userIds, 
                             subject_template=report_validation_failed_subject_template,
                             message_template=report_validation_failed_template,
-                            kwargs=kwargs)
+                            kwargs=kwargs,
+                            template_name='report_validation_failed')
 
 def report_validation_passed(userIds, **kwargs):
     if send_messages:
         return send_message(userIds=userIds,
                             subject_template=report_validation_passed_subject_template,
                             message_template=report_validation_passed_template,
-                            kwargs=kwargs)
+                            kwargs=kwargs,
+                            template_name='report_validation_passed')
 
 def scoring_succeeded(userIds, **kwargs):
     if send_messages:
         return send_message(userIds=userIds,
                             subject_template=scoring_succeeded_subject_template,
                             message_template=scoring_succeeded_template,
-                            kwargs=kwargs)
+                            kwargs=kwargs,
+                            template_name='scoring_succeeded')
 
 def scoring_error(userIds, **kwargs):
     if send_messages:
         return send_message(userIds=userIds,
                             subject_template=scoring_error_subject_template,
                             message_template=scoring_error_template,
-                            kwargs=kwargs)
+                            kwargs=kwargs,
+                            template_name='scoring_error')
 
 def error_notification(userIds, **kwargs):
     if send_notifications:
         return send_message(userIds=userIds,
                             subject_template=notification_subject_template,
                             message_template=error_notification_template,
-                            kwargs=kwargs)
+                            kwargs=kwargs,
+                            template_name='error_notification')
 
-def send_message(userIds, subject_template, message_template, kwargs):
-    subject = formatter.format(subject_template, **kwargs)
-    message = formatter.format(message_template, **kwargs)
+def use_outbox(dir, **kwargs):
+    """
+    Queue messages in an on-disk outbox at dir and start a background
+    thread sending them. Call stop_outbox() before exiting.
+    """
+    global outbox, sender
+    outbox = Outbox(dir, **kwargs)
+    sender = Sender(outbox, _deliver)
+    sender.start()
+
+
+def stop_outbox():
+    """Send any messages still in the outbox and stop the sender thread"""
+    global outbox, sender
+    if sender is not None:
+        print "sent %d queued messages" % sender.stop()
+    outbox = None
+    sender = None
+
+
+def _deliver(userIds, messageSubject, messageBody):
+    response = syn.sendMessage(
+        userIds=userIds,
+        messageSubject=messageSubject,
+        messageBody=messageBody,
+        contentType="text/html")
+    print "sent: ", unicode(response).encode('utf-8')
+    return response
+
+
+def send_message(userIds, subject_template, message_template, kwargs, template_name=None):
+    subject = render(subject_template, kwargs, escape_values)
+    message = render(message_template, kwargs, escape_values)
+    if digest:
+        for userId in userIds:
+            _digests.setdefault(userId, []).append((subject, message))
+        return None
+    ## one message per submission, template and submission status version,
+    ## so that a submission reset and rescored gets its new messages; without
+    ## a status_etag, only retries within this run are deduplicated
+    if template_name and 'submission_id' in kwargs:
+        key = "%s_%s_%s" % (kwargs['submission_id'], template_name, kwargs.get('status_etag') or run_id)
+    else:
+        key = None
+    with tracing.span('message', template=template_name):
+        return _dispatch(userIds, subject, message, key)
+
+
+def send_digests():
+    """
+    Send the messages held while in digest mode: a recipient with a single
+    message gets it as is, otherwise their messages are combined into one
+    digest. Recipients whose subject and body come out the same share a
+    single sendMessage call.
+    """
+    by_content = OrderedDict()
+    for userId, held in _digests.iteritems():
+        if len(held) == 1:
+            subject, message = held[0]
+        else:
+            kwargs = dict(count=len(held),
+                          messages=digest_separator.join(
+                              render(digest_entry_template, dict(subject=cgi.escape(_text(subject)), message=message))
+                              for subject, message in held))
+            subject = render(digest_subject_template, kwargs)
+            message = render(digest_template, kwargs)
+        by_content.setdefault((subject, message), []).append(userId)
+    _digests.clear()
+
+    for (subject, message), userIds in by_content.iteritems():
+        ## the same digest going to other recipients is a different message
+        content = u'%s\n%s\n%s' % (','.join(sorted(str(userId) for userId in userIds)), _text(subject), _text(message))
+        key = "digest_" + hashlib.md5(content.encode('utf-8')).hexdigest()
+        _dispatch(userIds, subject, message, key)
+    return len(by_content)
+
+
+def _dispatch(userIds, subject, message, key=None):
     if dry_run:
         print "\nDry Run: would have sent:"
         print subject
         print "-" * 60
         print message
         return None
+    elif syn and outbox is not None:
+        ## messages without a key are always queued
+        outbox.put(key or str(uuid.uuid4()), dict(userIds=userIds, messageSubject=subject, messageBody=message))
+        return None
     elif syn:
-        response = syn.sendMessage(
-            userIds=userIds,
-            messageSubject=subject,
-            messageBody=message,
-            contentType="text/html")
-        print "sent: ", unicode(response).encode('utf-8')
-        return response
+        return _deliver(userIds, subject, message)
     else:
         sys.stderr.write("Can't send message. No Synapse object configured\n")
 
 
-
+## parse all of the templates above at import
+for _name, _template in globals().items():
+    if _name.endswith('_template') and isinstance(_template, basestring):
+        compile_template(_template)
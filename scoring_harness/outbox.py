@@ -0,0 +1,166 @@
+import errno
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import timedelta
+
+# default sending rate (messages/second) and burst size
+OUTBOX_DEFAULT_RATE = 1.0
+OUTBOX_DEFAULT_BURST = 5
+
+# a message whose key was already sent within this window is dropped
+OUTBOX_DEFAULT_DEDUP_WINDOW = timedelta(hours=12)
+
+# how many times to try a message before parking it in the failed folder
+OUTBOX_RETRY_COUNT = 5
+
+
+class TokenBucket(object):
+    """
+    Allows on average `rate` events per second, with bursts of up to
+    `capacity` events.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.last = time.time()
+
+    def take(self):
+        """Block until a token is available, then consume it"""
+        while True:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+
+class Outbox(object):
+    """
+    A durable queue of outbound messages, kept as one JSON file per message
+    under [dir]/pending. Sent messages are moved to [dir]/sent and messages
+    that keep failing to [dir]/failed.
+
+    Each message has a key. Queueing a message whose key is already pending,
+    or was sent within dedup_window, does nothing, so a crashed run that is
+    restarted won't send the same message twice.
+    """
+    def __init__(self, dir, rate=OUTBOX_DEFAULT_RATE, burst=OUTBOX_DEFAULT_BURST,
+                 dedup_window=OUTBOX_DEFAULT_DEDUP_WINDOW):
+        self.dir = dir
+        self.bucket = TokenBucket(rate, burst)
+        self.dedup_window = dedup_window
+        self.lock = threading.Lock()
+        for folder in ['pending', 'sent', 'failed']:
+            try:
+                os.makedirs(os.path.join(dir, folder))
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+
+    def _path(self, folder, key):
+        return os.path.join(self.dir, folder, re.sub(r'[^\w.-]', '_', key) + '.json')
+
+    def put(self, key, message):
+        """
+        Queue a message, a dict of keyword arguments for syn.sendMessage.
+
+        :returns: True if queued, False if it was a duplicate
+        """
+        with self.lock:
+            pending_path = self._path('pending', key)
+            sent_path = self._path('sent', key)
+            if os.path.exists(pending_path):
+                return False
+            if (os.path.exists(sent_path) and
+                    time.time() - os.path.getmtime(sent_path) < self.dedup_window.total_seconds()):
+                return False
+            ## write then rename so the sender never sees a partial file
+            with open(pending_path + '.tmp', 'w') as f:
+                json.dump({'key': key, 'attempts': 0, 'message': message}, f)
+            os.rename(pending_path + '.tmp', pending_path)
+            return True
+
+    def pending(self):
+        """Paths of pending messages, oldest first"""
+        folder = os.path.join(self.dir, 'pending')
+        paths = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith('.json')]
+        return sorted(paths, key=os.path.getmtime)
+
+    def send_one(self, path, send):
+        """
+        Rate limit, then try to send the message at path with send(**message)
+        """
+        with open(path) as f:
+            entry = json.load(f)
+        self.bucket.take()
+        try:
+            send(**entry['message'])
+        except Exception as ex1:
+            entry['attempts'] += 1
+            entry['error'] = str(ex1)
+            sys.stderr.write("Error sending message %s (attempt %d of %d): %s\n"
+                             % (entry['key'], entry['attempts'], OUTBOX_RETRY_COUNT, ex1))
+            with open(path + '.tmp', 'w') as f:
+                json.dump(entry, f)
+            if entry['attempts'] >= OUTBOX_RETRY_COUNT:
+                os.rename(path + '.tmp', self._path('failed', entry['key']))
+                os.remove(path)
+            else:
+                os.rename(path + '.tmp', path)
+            return False
+        with self.lock:
+            os.rename(path, self._path('sent', entry['key']))
+        return True
+
+    def drain(self, send):
+        """
+        Send everything that's pending. Failed messages are retried until
+        they run out of attempts.
+
+        :returns: the number of messages sent
+        """
+        sent = 0
+        while True:
+            paths = self.pending()
+            if not paths:
+                return sent
+            for path in paths:
+                if self.send_one(path, send):
+                    sent += 1
+
+
+class Sender(threading.Thread):
+    """
+    Drains an outbox in the background until stopped. stop() sends whatever
+    is left before returning.
+    """
+    def __init__(self, outbox, send, poll_interval=1):
+        super(Sender, self).__init__()
+        self.daemon = True
+        self.outbox = outbox
+        self.send = send
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+        self.sent = 0
+
+    def run(self):
+        while not self.stopping.is_set():
+            paths = self.outbox.pending()
+            for path in paths:
+                if self.outbox.send_one(path, self.send):
+                    self.sent += 1
+            if not paths:
+                self.stopping.wait(self.poll_interval)
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+        self.sent += self.outbox.drain(self.send)
+        return self.sent
@@ -0,0 +1,101 @@
+## Quick checks on a submission's files before the checker runs.
+##
+## The checkers take minutes even on submissions that are plainly broken:
+## outputs missing, empty or not in the format the workflow produces. A
+## queue can list what its outputs must look like under 'precheck' in
+## challenge_config.evaluation_queues, as a list of rules like
+##
+##   {'glob': '*.bam', 'min_size': 1024, 'magic': 'bam', 'index': ['.bai']}
+##
+## Each rule needs at least one file matching 'glob', relative to the
+## submission folder, and every matching file must have at least
+## 'min_size' bytes (default 1), start with the 'magic' bytes, one of the
+## formats in MAGIC or a literal string, and have an index file next to it
+## with one of the 'index' suffixes, either added to its name or in place
+## of its extension. Only the first few bytes of each file are read.
+
+import fnmatch
+import os
+import zlib
+
+# named formats for 'magic': (is gzipped, first bytes once decompressed);
+# None means the format may or may not be gzipped
+MAGIC = {
+    'gz':   (False, '\x1f\x8b'),
+    'bgzf': (False, '\x1f\x8b\x08\x04'),
+    'zip':  (False, 'PK\x03\x04'),
+    'bam':  (True, 'BAM\x01'),
+    'bcf':  (True, 'BCF\x02'),
+    'cram': (False, 'CRAM'),
+    'vcf':  (None, '##fileformat=VCF'),
+}
+
+GZIP_MAGIC = '\x1f\x8b'
+
+# how many bytes are read from the start of each file
+PRECHECK_HEAD_BYTES = 4096
+
+
+def _head(path, decompress):
+    """The first bytes of a file, gunzipped if asked"""
+    with open(path, 'rb') as f:
+        head = f.read(PRECHECK_HEAD_BYTES)
+    if decompress:
+        try:
+            ## wbits=31 expects a gzip header; a partial stream is fine
+            head = zlib.decompressobj(31).decompress(head)
+        except zlib.error:
+            return ''
+    return head
+
+
+def _has_magic(path, magic):
+    if magic not in MAGIC:
+        return _head(path, False).startswith(magic)
+    gzipped, prefix = MAGIC[magic]
+    if gzipped is None:
+        gzipped = _head(path, False).startswith(GZIP_MAGIC)
+    return _head(path, gzipped).startswith(prefix)
+
+
+def _files(submission_dir):
+    """Paths of the submission's files relative to its folder, not following links"""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(submission_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            ## the known good outputs are linked into the same folder
+            if not os.path.islink(path):
+                found.append(os.path.relpath(path, submission_dir))
+    return found
+
+
+def check(submission_dir, rules):
+    """
+    Apply a queue's precheck rules to the files in a submission folder.
+
+    :returns: a list of problems, each a sentence for the participant,
+              empty if the submission passes
+    """
+    files = _files(submission_dir)
+    present = set(files)
+    problems = []
+    for rule in rules:
+        ## '*' matches across folders too
+        matches = fnmatch.filter(files, rule['glob'])
+        if not matches:
+            problems.append("No output file matches %s." % rule['glob'])
+            continue
+        for path in matches:
+            full_path = os.path.join(submission_dir, path)
+            size = os.path.getsize(full_path)
+            if size < rule.get('min_size', 1):
+                problems.append("%s is %d bytes, expected at least %d." % (path, size, rule.get('min_size', 1)))
+            elif 'magic' in rule and not _has_magic(full_path, rule['magic']):
+                problems.append("%s doesn't look like a %s file." % (path, rule['magic']))
+            if 'index' in rule:
+                indexes = [path + suffix for suffix in rule['index']] + \
+                          [os.path.splitext(path)[0] + suffix for suffix in rule['index']]
+                if not present.intersection(indexes):
+                    problems.append("%s has no index (%s)." % (path, ", ".join(rule['index'])))
+    return problems
@@ -0,0 +1,228 @@
+## A history of how long the checker took on each submission, and how much
+## memory it needed, so that scheduling, timeouts and capacity planning can
+## go by past runs rather than guesses.
+##
+## Each run is recorded with its queue, the size of its input, where it ran
+## and how it ended. Per queue, quantiles() summarizes past runs and
+## predict() fits wall time to input size.
+##
+## Like the journal, the history is module level state: call open_history()
+## once per run, then measure() still runs the block but records nothing if
+## no history was opened.
+
+import errno
+import math
+import os
+import socket
+import sqlite3
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+import scheduler
+
+# the quantiles reported for each queue
+RUNTIME_QUANTILES = [0.5, 0.9, 0.99]
+
+# fewest runs of different sizes to fit a queue's wall time to input size
+RUNTIME_MIN_FIT = 5
+
+SCHEMA = """
+create table if not exists runs (
+    queue text not null,
+    submission_id text not null,
+    submitter text,
+    runner text,
+    host text,
+    input_bytes integer,
+    seconds real not null,
+    max_rss integer,
+    outcome text not null,
+    finished real not null
+)
+"""
+
+INDEX = "create index if not exists runs_by_queue on runs (queue, finished)"
+
+## Module level state
+current = None
+
+
+def _quantile(sorted_values, q):
+    return sorted_values[max(0, int(math.ceil(q * len(sorted_values))) - 1)]
+
+
+def _median(values):
+    return _quantile(sorted(values), 0.5) if values else None
+
+
+def directory_size(path):
+    """Bytes in the files under path, not following links"""
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            if not os.path.islink(filepath):
+                total += os.path.getsize(filepath)
+    return total
+
+
+def call(command):
+    """
+    Like subprocess.call, also reporting how much memory the command took.
+    That is the most any one process it started had resident; containers
+    it runs through docker belong to the docker daemon and aren't counted.
+
+    :returns: (return code, largest resident memory in kilobytes)
+    """
+    process = subprocess.Popen(command)
+    while True:
+        try:
+            pid, status, usage = os.wait4(process.pid, 0)
+            break
+        except OSError as err:
+            ## interrupted by a signal, such as the worker's SIGTERM handler
+            if err.errno != errno.EINTR:
+                raise
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    return process.returncode, usage.ru_maxrss
+
+
+class History(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute(SCHEMA)
+        self.db.execute(INDEX)
+
+    def record(self, queue, submission_id, seconds, outcome, submitter=None, runner=None,
+               input_bytes=None, max_rss=None, host=None):
+        with self.lock:
+            self.db.execute("insert into runs values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (str(queue), str(submission_id), submitter and str(submitter), runner,
+                             host or socket.gethostname(), input_bytes, seconds, max_rss, outcome, time.time()))
+
+    def runs(self, queue):
+        """A queue's past runs as dicts, oldest first"""
+        with self.lock:
+            cursor = self.db.execute("select * from runs where queue=? order by finished", (str(queue),))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def queues(self):
+        with self.lock:
+            return [queue for (queue,) in self.db.execute("select distinct queue from runs order by queue")]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def open_history(path):
+    global current
+    current = History(path)
+    return current
+
+
+def close_history():
+    global current
+    if current is not None:
+        current.close()
+        current = None
+
+
+@contextmanager
+def measure(queue, submission_id, **tags):
+    """
+    Time the enclosed block as one run of the checker and add it to the
+    history. The block can fill in max_rss and outcome in the dict it's
+    given; the outcome is 'error' if the block raises and 'finished' if it
+    says nothing. Other tags, like runner, submitter and input_bytes, are
+    recorded as given.
+    """
+    run = dict(tags)
+    start = time.time()
+    try:
+        yield run
+    except BaseException:
+        run.setdefault('outcome', 'error')
+        raise
+    finally:
+        run['seconds'] = time.time() - start
+        run.setdefault('outcome', 'finished')
+        if current is not None:
+            current.record(queue, submission_id, **run)
+
+
+def runs(queue):
+    if current is None:
+        return []
+    return current.runs(queue)
+
+
+def quantiles(queue, field='seconds', qs=RUNTIME_QUANTILES):
+    """
+    Quantiles of a field of a queue's past runs, such as 'seconds' or
+    'max_rss', as a {quantile: value} dict, empty if there are no runs.
+    Runs that errored out are left out.
+    """
+    values = sorted(run[field] for run in runs(queue)
+                    if run[field] is not None and run['outcome'] != 'error')
+    if not values:
+        return {}
+    return {q: _quantile(values, q) for q in qs}
+
+
+def fit(queue):
+    """
+    Least squares fit of a queue's wall time to input size.
+
+    :returns: (seconds, seconds per byte), or None if there aren't
+              RUNTIME_MIN_FIT runs of at least two different sizes
+    """
+    points = [(run['input_bytes'], run['seconds']) for run in runs(queue)
+              if run['input_bytes'] is not None and run['outcome'] != 'error']
+    if len(points) < RUNTIME_MIN_FIT or len(set(x for x, y in points)) < 2:
+        return None
+    mean_x = sum(x for x, y in points) / float(len(points))
+    mean_y = sum(y for x, y in points) / float(len(points))
+    slope = (sum((x - mean_x) * (y - mean_y) for x, y in points) /
+             sum((x - mean_x) ** 2 for x, y in points))
+    return mean_y - slope * mean_x, slope
+
+
+def predict(queue, input_bytes=None):
+    """
+    Seconds the checker is expected to take on a submission to a queue,
+    from the size fit if there is one and the size is known, else the
+    queue's median. None if the queue has no history.
+    """
+    line = fit(queue) if input_bytes is not None else None
+    if line is not None:
+        return max(0.0, line[0] + line[1] * input_bytes)
+    return quantiles(queue, qs=[0.5]).get(0.5)
+
+
+def estimator(queue):
+    """
+    A function estimating the checker's run time on a submission to a
+    queue before it's downloaded, going by the median size of what its
+    submitter sent before, else the queue's median run time.
+    """
+    history = runs(queue)
+    line = fit(queue)
+    median = quantiles(queue, qs=[0.5]).get(0.5)
+    sizes = {}
+    for run in history:
+        if run['input_bytes'] is not None:
+            sizes.setdefault(run['submitter'], []).append(run['input_bytes'])
+
+    def estimate(submission):
+        size = _median(sizes.get(str(scheduler.submitter(submission)), []))
+        if line is not None and size is not None:
+            return max(0.0, line[0] + line[1] * size)
+        return median
+    return estimate
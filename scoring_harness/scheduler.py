@@ -0,0 +1,136 @@
+## Orders the submissions waiting in a queue before they're validated.
+##
+## Synapse returns pending submissions in the order they arrived, so a team
+## that submits twenty times in a row holds up everyone who submits after
+## them. A Scheduler sorts the pending (submission, status) bundles by the
+## keys of a list of policies, earlier policies taking precedence and
+## arrival order breaking ties.
+##
+## A policy is any object with the methods of Policy. Policies are chosen
+## by name from POLICIES, or given as 'module.ClassName' to plug in one
+## defined elsewhere, for example in challenge_config. Either way the class
+## is created with the same keyword options, and ignores the ones it
+## doesn't use.
+
+import importlib
+import time
+from collections import Counter
+from datetime import datetime
+
+# the policies used when none are given
+SCHEDULER_DEFAULT_POLICIES = ['admin-boost', 'fair-share']
+
+
+def submitter(submission):
+    """The team a submission was made for, or its user for solo submissions"""
+    return submission.get('teamId') or submission.userId
+
+
+def created_on(submission):
+    """When a submission was made, in seconds since the epoch"""
+    created = datetime.strptime(submission.createdOn, '%Y-%m-%dT%H:%M:%S.%fZ')
+    return (created - datetime(1970, 1, 1)).total_seconds()
+
+
+class Policy(object):
+    """
+    Orders bundles by key(); bundles with smaller keys go first. prepare()
+    sees all the pending bundles before any keys are asked for, along with
+    a context dict from the caller, such as an 'estimate' function giving a
+    submission's expected checker run time in seconds, or None if unknown.
+    """
+    def __init__(self, **options):
+        pass
+
+    def prepare(self, bundles, context):
+        pass
+
+    def key(self, submission, status):
+        return 0
+
+
+class FairShare(Policy):
+    """
+    Takes turns between submitters: everyone's first pending submission
+    goes before anyone's second, and so on.
+    """
+    def prepare(self, bundles, context):
+        self.turns = {}
+        seen = Counter()
+        for submission, status in sorted(bundles, key=lambda bundle: bundle[0].createdOn):
+            self.turns[submission.id] = seen[submitter(submission)]
+            seen[submitter(submission)] += 1
+
+    def key(self, submission, status):
+        return self.turns[submission.id]
+
+
+class ShortestExpectedFirst(Policy):
+    """
+    Runs the submissions expected to take the checker the least time first,
+    going by the context's 'estimate'. Submissions with no estimate go last.
+    """
+    def prepare(self, bundles, context):
+        estimate = context.get('estimate', lambda submission: None)
+        self.expected = {}
+        for submission, status in bundles:
+            seconds = estimate(submission)
+            self.expected[submission.id] = float('inf') if seconds is None else seconds
+
+    def key(self, submission, status):
+        return self.expected[submission.id]
+
+
+class AdminBoost(Policy):
+    """
+    Runs submissions picked by the challenge admins first: those listed in
+    submission_ids, and those from the users or teams in submitters.
+    """
+    def __init__(self, submission_ids=(), submitters=(), **options):
+        self.submission_ids = set(str(id) for id in submission_ids)
+        self.submitters = set(str(id) for id in submitters)
+
+    def key(self, submission, status):
+        boosted = (submission.id in self.submission_ids or
+                   str(submission.userId) in self.submitters or
+                   str(submission.get('teamId')) in self.submitters)
+        return 0 if boosted else 1
+
+
+POLICIES = {
+    'fair-share': FairShare,
+    'shortest-first': ShortestExpectedFirst,
+    'admin-boost': AdminBoost,
+}
+
+
+def make_policy(name, **kwargs):
+    """
+    Create the policy with the given name in POLICIES, or the class at a
+    dotted path like 'my_policies.NewestFirst', with the given options.
+    """
+    if name in POLICIES:
+        cls = POLICIES[name]
+    else:
+        module_name, _, class_name = name.rpartition('.')
+        if not module_name:
+            raise ValueError("Unknown scheduling policy %s, choose from: %s" % (name, ", ".join(sorted(POLICIES))))
+        cls = getattr(importlib.import_module(module_name), class_name)
+    return cls(**kwargs)
+
+
+class Scheduler(object):
+    def __init__(self, policies):
+        self.policies = policies
+
+    def order(self, bundles, **context):
+        """Return the (submission, status) bundles in the order to run them"""
+        for policy in self.policies:
+            policy.prepare(bundles, context)
+        return sorted(bundles, key=lambda (submission, status):
+                      tuple(policy.key(submission, status) for policy in self.policies) + (submission.createdOn,))
+
+
+def queue_delay(submission, now=None):
+    """Seconds a submission has been waiting since it was made"""
+    return (now if now is not None else time.time()) - created_on(submission)
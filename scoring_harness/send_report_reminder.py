@@ -1,11 +1,10 @@
 import os
 import sys
-import time
 
-import synapseclient
 from synapseclient import Evaluation, Submission, SubmissionStatus
 import challenge_config as conf
 import challenge as chal
+import client
 import messages
 
 
@@ -13,7 +12,11 @@ def send_reminders(syn, evaluation):
     if type(evaluation) != Evaluation:
         evaluation = syn.getEvaluation(evaluation)
     
-    for submission, status in syn.getSubmissionBundles(evaluation, status='VALIDATED', limit=100):
+    bundles = list(syn.getSubmissionBundles(evaluation, status='VALIDATED', limit=100))
+    identities = chal.get_identities()
+    identities.prefetch(user_ids=[submission.userId for submission, status in bundles])
+
+    for submission, status in bundles:
         if submission.id in ['9622071']:
              continue        
 	print("> checking report status for submission {}".format(submission.id))
@@ -26,29 +29,36 @@ def send_reminders(syn, evaluation):
                  continue
 
         print("sending message for initialized / in progress report...")
-        profile = syn.getUserProfile(submission.userId)
         messages.report_reminder(
             userIds=[submission.userId],
-            username=chal.get_user_name(profile),
+            username=identities.user_name(submission.userId),
             queue_name=evaluation.name,
             submission_id=submission.id,
             report_entity_id=status_annotations['reportEntityId'])
-        time.sleep(10)
 
 
 def main(argv):
-    syn = synapseclient.Synapse()
-    user = os.environ.get('SYNAPSE_USER', None)
-    password = os.environ.get('SYNAPSE_PASSWORD', None)
-    syn.login(email=user, password=password)
+    syn = client.login()
+    chal.syn = syn
     messages.syn = syn
+    ## reminders are sent from the outbox at a steady rate while we keep
+    ## checking submissions
+    scriptDir = os.path.dirname(os.path.realpath(__file__))
+    messages.use_outbox(os.path.join(scriptDir, 'outbox'))
+    ## users with several incomplete reports get a single reminder
+    messages.digest = True
     project_id = conf.CHALLENGE_SYN_ID
-    for queue_info in conf.evaluation_queues:
-    #eval_id = argv[0]
-        if queue_info['id'] > 9603664:
-            print("sending report reminders for queue {}..."
-                  .format(queue_info['id']))
-            send_reminders(syn, queue_info['id'])
+    try:
+        for queue_info in conf.evaluation_queues:
+        #eval_id = argv[0]
+            if queue_info['id'] > 9603664:
+                print("sending report reminders for queue {}..."
+                      .format(queue_info['id']))
+                send_reminders(syn, queue_info['id'])
+    finally:
+        messages.send_digests()
+        messages.stop_outbox()
+        syn.summary()
 
 
 if __name__ == '__main__':
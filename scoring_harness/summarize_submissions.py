@@ -1,7 +1,7 @@
-import os
 import pandas as pd
 import synapseclient
 import challenge_config as conf
+import client
 from leaderboard import leaderboardQuery
 
 
@@ -155,10 +155,7 @@ def update_overall_stats_table(syn, project_id, overall_stats_df):
 
 
 def main():
-    syn = synapseclient.Synapse()
-    user = os.environ.get('SYNAPSE_USER', None)
-    password = os.environ.get('SYNAPSE_PASSWORD', None)
-    syn.login(email=user, password=password)
+    syn = client.login()
 
     project_id = conf.CHALLENGE_SYN_ID
     submission_df = collect_submissions(syn, project_id)
@@ -171,6 +168,7 @@ def main():
 
     overall_stats_df = compute_overall_stats(valid_df, team_stats_df)
     update_overall_stats_table(syn, project_id, overall_stats_df)
+    syn.summary()
 
 if __name__ == '__main__':
     main()
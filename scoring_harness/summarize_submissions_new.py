@@ -1,9 +1,9 @@
 # -*- coding: utf-8 -*-
-import os
 import pandas as pd
 import synapseclient
 import challenge_config as conf
-from leaderboard import leaderboardQuery
+import client
+from leaderboard import leaderboardQuery, normalize_text_columns
 
 
 def collect_submissions(syn, challenge_id):
@@ -61,20 +61,13 @@ def update_all_submissions_table(syn, project_id, submission_df):
 
 
 def main():
-    syn = synapseclient.Synapse()
-    user = os.environ.get('SYNAPSE_USER', None)
-    password = os.environ.get('SYNAPSE_PASSWORD', None)
-    syn.login(email=user, password=password)
+    syn = client.login()
 
     project_id = conf.CHALLENGE_SYN_ID
     submission_df = collect_submissions(syn, project_id)
-    submission_df = (submission_df
-                     .replace([None], '')
-                     .apply(lambda col: col.map(
-                         lambda x: x.encode('unicode-escape')
-                                    .decode('utf-8')
-                     )))         
+    submission_df = normalize_text_columns(submission_df)
     update_all_submissions_table(syn, project_id, submission_df)
+    syn.summary()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,90 @@
+## Lightweight timing of pipeline stages.
+##
+## Wrap a stage in `with tracing.span('stage', queue=..., submission=...)`
+## and call summary() at the end of a run for a table of where the time
+## went, or write the raw spans out as JSON lines or a Prometheus textfile.
+
+import json
+import math
+import os
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+## Module level state; spans from every thread end up here
+spans = []
+
+
+@contextmanager
+def span(stage, **tags):
+    """
+    Time the enclosed block as one span of the given stage. Tags, such as
+    the queue and submission, are recorded with it.
+    """
+    record = dict(tags, stage=stage, start=time.time(), error=False)
+    try:
+        yield record
+    except BaseException:
+        record['error'] = True
+        raise
+    finally:
+        record['seconds'] = time.time() - record['start']
+        spans.append(record)
+
+
+def record(stage, seconds, **tags):
+    """Add a span timed some other way, such as the wait in a queue"""
+    spans.append(dict(tags, stage=stage, start=time.time() - seconds, seconds=seconds, error=False))
+
+
+def _quantile(sorted_values, q):
+    return sorted_values[max(0, int(math.ceil(q * len(sorted_values))) - 1)]
+
+
+def _group(by):
+    groups = OrderedDict()
+    for record in sorted(spans, key=lambda record: record['start']):
+        key = tuple(unicode(record.get(tag, '')) for tag in by)
+        groups.setdefault(key, []).append(record['seconds'])
+    return groups
+
+
+def summary(out=sys.stdout, by=('stage', 'queue')):
+    """Print count, total, mean and p95 seconds per stage and queue"""
+    if not spans:
+        return
+    out.write("\n%-24s %-30s %7s %10s %9s %9s\n" % ('stage', 'queue', 'count', 'total(s)', 'mean(s)', 'p95(s)'))
+    out.write("-" * 94 + "\n")
+    for key, seconds in _group(by).iteritems():
+        seconds.sort()
+        out.write((u"%-24s %-30s %7d %10.2f %9.3f %9.3f\n" % (
+            key + (len(seconds), sum(seconds), sum(seconds)/len(seconds), _quantile(seconds, 0.95))
+        )).encode('utf-8'))
+
+
+def write_jsonl(path):
+    """Append every span to path, one JSON object per line"""
+    with open(path, 'a') as f:
+        for record in spans:
+            f.write(json.dumps(record) + "\n")
+
+
+def write_prometheus(path, by=('stage', 'queue')):
+    """
+    Write per stage and queue timings in the Prometheus text format, for
+    node_exporter's textfile collector.
+    """
+    lines = ["# HELP challenge_stage_seconds Time spent in each pipeline stage during the last run, or the last summary interval of serve",
+             "# TYPE challenge_stage_seconds summary"]
+    for key, seconds in _group(by).iteritems():
+        seconds.sort()
+        labels = ','.join('%s="%s"' % (tag, value.replace('"', '\\"')) for tag, value in zip(by, key))
+        for q in [0.5, 0.95]:
+            lines.append('challenge_stage_seconds{%s,quantile="%s"} %f' % (labels, q, _quantile(seconds, q)))
+        lines.append('challenge_stage_seconds_sum{%s} %f' % (labels, sum(seconds)))
+        lines.append('challenge_stage_seconds_count{%s} %d' % (labels, len(seconds)))
+    ## the collector may read at any time, so replace the file in one go
+    with open(path + '.tmp', 'w') as f:
+        f.write((u"\n".join(lines) + u"\n").encode('utf-8'))
+    os.rename(path + '.tmp', path)
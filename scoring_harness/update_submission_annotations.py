@@ -1,10 +1,10 @@
-import os
 import sys
 
 import synapseclient
 from synapseclient import Evaluation, Submission, SubmissionStatus
 import challenge_config as conf
 import challenge as chal
+import client
 
 def parse_report(syn, evaluation, submission, status_annotations):
     report, _, _ = conf.validate_submission_report(
@@ -16,6 +16,7 @@ def update_submissions(syn, evaluation, annotation_keys=None):
     if type(evaluation) != Evaluation:
         evaluation = syn.getEvaluation(evaluation)
     
+    status_writer = chal.StatusWriter(evaluation)
     for submission, status in syn.getSubmissionBundles(evaluation, status='VALIDATED', limit=100):
         #if submission.id not in ['9638106']:
         #     continue        
@@ -35,15 +36,13 @@ def update_submissions(syn, evaluation, annotation_keys=None):
         add_annotations = synapseclient.annotations.to_submission_status_annotations(
             status_annotations, is_private=False
         )
-        status = chal.update_single_submission_status(status, add_annotations)
-        syn.store(status)
+        status_writer.update(status, add_annotations)
+    status_writer.flush()
 
 
 def main(argv):
-    syn = synapseclient.Synapse()
-    user = os.environ.get('SYNAPSE_USER', None)
-    password = os.environ.get('SYNAPSE_PASSWORD', None)
-    syn.login(email=user, password=password)
+    syn = client.login()
+    chal.syn = syn
 
     project_id = conf.CHALLENGE_SYN_ID
     #for queue_info in conf.evaluation_queues:
@@ -51,6 +50,7 @@ def main(argv):
     print("backfilling submission annotations for queue {}...".format(eval_id))
     
     update_submissions(syn, eval_id, annotation_keys=['platform', 'environment'])
+    syn.summary()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,266 @@
+## A queue of checker jobs shared between hosts through a directory that
+## they all mount, such as an NFS or EFS volume.
+##
+## The coordinator, which holds the challenge lock and talks to Synapse,
+## publishes a job for each submission to be checked. Workers on any host
+## claim jobs, run the checker and post the results back for the
+## coordinator to store. Only renames are relied on to be atomic, so no
+## server or database is needed.
+
+import errno
+import json
+import os
+import re
+import socket
+import threading
+import time
+
+# seconds a claimed job is held without a renewal before it's given to
+# another worker
+WORKQUEUE_LEASE = 10*60
+
+# how many times a job's lease may run out before it's given up on
+WORKQUEUE_MAX_ATTEMPTS = 3
+
+# results nobody collected are dropped after this many seconds
+WORKQUEUE_RETENTION = 7*24*60*60
+
+
+def worker_name():
+    """Identifies this process to the other hosts sharing the queue"""
+    return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+    """
+    Jobs are JSON files that move from [dir]/pending to [dir]/claimed when a
+    worker claims them, and on to [dir]/done with their result. A claimed
+    job's modification time is its lease; workers renew it while they work,
+    and expire() returns jobs whose worker stopped renewing to pending.
+
+    Each job has a key and a priority. Pending jobs are named by priority
+    then key, and claimed in that order, smallest priority first, since
+    many jobs are published within the same second. Publishing a job whose
+    key is already claimed or done does nothing; if it's still pending,
+    only its priority changes.
+    """
+    def __init__(self, dir, lease=WORKQUEUE_LEASE):
+        self.dir = dir
+        self.lease = lease
+        self.lock = threading.Lock()
+        for folder in ['pending', 'claimed', 'done']:
+            try:
+                os.makedirs(os.path.join(dir, folder))
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+
+    def _path(self, folder, key):
+        return os.path.join(self.dir, folder, re.sub(r'[^\w.-]', '_', key) + '.json')
+
+    def _pending_path(self, key, priority):
+        return os.path.join(self.dir, 'pending', '%08d_%s' % (priority, os.path.basename(self._path('pending', key))))
+
+    def _find_pending(self, key):
+        """The path of a key's pending job, whatever its priority, or None"""
+        filename = os.path.basename(self._path('pending', key))
+        for pending_filename in os.listdir(os.path.join(self.dir, 'pending')):
+            ## the priority is all digits, so the first _ ends it
+            if pending_filename.partition('_')[2] == filename:
+                return os.path.join(self.dir, 'pending', pending_filename)
+        return None
+
+    def _write(self, path, entry):
+        ## write then rename so no one sees a partial file; the temporary
+        ## name is unique to the host, since others write to the same folder
+        tmp_path = '%s.%s.tmp' % (path, worker_name())
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.rename(tmp_path, path)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except IOError as err:
+            if err.errno == errno.ENOENT:
+                return None
+            raise
+
+    def publish(self, key, job, priority=0):
+        """
+        Add a job, a dict describing the work to do, to be claimed after
+        those with a smaller priority, a non-negative number.
+
+        :returns: True if published, False if the key was already known
+        """
+        with self.lock:
+            if any(os.path.exists(self._path(folder, key)) for folder in ['claimed', 'done']):
+                return False
+            path = self._pending_path(key, priority)
+            pending_path = self._find_pending(key)
+            if pending_path is None:
+                self._write(path, {'key': key, 'priority': priority, 'attempts': 0, 'job': job})
+                return True
+            if pending_path != path:
+                try:
+                    os.rename(pending_path, path)
+                except OSError as err:
+                    ## claimed since
+                    if err.errno != errno.ENOENT:
+                        raise
+            return False
+
+    def _listing(self, folder):
+        """Paths of the jobs in a folder, oldest first"""
+        folder = os.path.join(self.dir, folder)
+        paths = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith('.json')]
+        modified = {}
+        for path in paths:
+            try:
+                modified[path] = os.path.getmtime(path)
+            except OSError:
+                ## taken by someone else since listing
+                pass
+        return sorted(modified, key=lambda path: (modified[path], path))
+
+    def claim(self, worker=None):
+        """
+        Take the pending job with the smallest priority, or return None if
+        there are none. The caller must renew() it at least every lease
+        seconds until it's completed or released.
+        """
+        pending = os.path.join(self.dir, 'pending')
+        for filename in sorted(f for f in os.listdir(pending) if f.endswith('.json')):
+            path = os.path.join(pending, filename)
+            claimed_path = os.path.join(self.dir, 'claimed', filename.partition('_')[2])
+            try:
+                os.rename(path, claimed_path)
+                ## the lease starts now, not when the job was published
+                os.utime(claimed_path, None)
+            except OSError as err:
+                if err.errno == errno.ENOENT:
+                    ## another worker got there first
+                    continue
+                raise
+            entry = self._read(claimed_path)
+            if entry is None:
+                continue
+            entry['worker'] = worker or worker_name()
+            return entry
+        return None
+
+    def renew(self, entry):
+        """
+        Extend the lease on a claimed job.
+
+        :returns: False if the lease had run out and the job was taken back
+        """
+        try:
+            os.utime(self._path('claimed', entry['key']), None)
+            return True
+        except OSError as err:
+            if err.errno == errno.ENOENT:
+                return False
+            raise
+
+    def complete(self, entry, result):
+        """Post a claimed job's result, a dict, for the coordinator"""
+        entry = dict(entry, result=result, completed=time.time())
+        self._write(self._path('done', entry['key']), entry)
+        try:
+            os.remove(self._path('claimed', entry['key']))
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+    def _give_back(self, path, entry, error):
+        """
+        Return a job taken from path to pending, or give it up with error,
+        given the number of attempts, after WORKQUEUE_MAX_ATTEMPTS.
+        """
+        entry['attempts'] += 1
+        if entry['attempts'] >= WORKQUEUE_MAX_ATTEMPTS:
+            entry['result'] = {'error': error % entry['attempts']}
+            self._write(self._path('done', entry['key']), entry)
+        else:
+            self._write(self._pending_path(entry['key'], entry.get('priority', 0)), entry)
+        os.remove(path)
+
+    def release(self, entry):
+        """
+        Give a claimed job back to pending straight away, after failing on
+        it, rather than holding it until the lease runs out.
+        """
+        ## take it out of claimed first, so expire() can't return it too
+        path = self._path('claimed', entry['key'])
+        released_path = '%s.%s.tmp' % (path, worker_name())
+        try:
+            os.rename(path, released_path)
+        except OSError as err:
+            if err.errno == errno.ENOENT:
+                ## the lease ran out and it was taken back already
+                return
+            raise
+        entry = dict(entry)
+        entry.pop('worker', None)
+        self._give_back(released_path, entry, "Workers failed on this job %d times")
+
+    def result(self, key):
+        """
+        The finished entry for a key, with its 'result', or None. Results
+        are kept for WORKQUEUE_RETENTION seconds.
+        """
+        return self._read(self._path('done', key))
+
+    def expire(self):
+        """
+        Return jobs whose lease ran out to pending, or give them up with an
+        error result after WORKQUEUE_MAX_ATTEMPTS, and drop old results.
+
+        :returns: the number of jobs returned or given up
+        """
+        now = time.time()
+        expired = 0
+        for path in self._listing('claimed'):
+            try:
+                if now - os.path.getmtime(path) < self.lease:
+                    continue
+            except OSError:
+                continue
+            entry = self._read(path)
+            if entry is None:
+                continue
+            self._give_back(path, entry, "No worker finished this job in %d attempts")
+            expired += 1
+        for path in self._listing('done'):
+            try:
+                if now - os.path.getmtime(path) > WORKQUEUE_RETENTION:
+                    os.remove(path)
+            except OSError:
+                pass
+        return expired
+
+
+class Heartbeat(threading.Thread):
+    """
+    Renews the lease on a claimed job in the background until stopped.
+    lost is set if the lease ran out anyway.
+    """
+    def __init__(self, queue, entry):
+        super(Heartbeat, self).__init__()
+        self.daemon = True
+        self.queue = queue
+        self.entry = entry
+        self.stopping = threading.Event()
+        self.lost = threading.Event()
+
+    def run(self):
+        while not self.stopping.wait(self.queue.lease / 3.0):
+            if not self.queue.renew(self.entry):
+                self.lost.set()
+                return
+
+    def stop(self):
+        self.stopping.set()
+        self.join()